@@ -1,4 +1,10 @@
 __version__ = "1.2.5"
 
+# before anything imports numpy or torch, they read their thread counts on import.
+from .threads import apply_environment, prepare_fork, FORK_WORKERS
+apply_environment()
+if FORK_WORKERS > 1:
+    prepare_fork()
+
 def main():
     import CMS.server
\ No newline at end of file
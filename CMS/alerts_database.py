@@ -5,6 +5,7 @@ Repo: github.com/Thinkodes/CMS
 """
 from tinydb import TinyDB, Query
 from datetime import datetime
+from .metrics import ALERT_DB_WRITE_LATENCY
 
 class TinyDBAlertSystem:
     def __init__(self):
@@ -25,13 +26,14 @@ class TinyDBAlertSystem:
 
     def register_urgent_alert(self, request):
         """Register a new urgent alert."""
-        doc_id = self.urgent_table.insert({
-            'message': request["message"],
-            "timestamp": datetime.now().strftime("%Y-%m-%d_%H-%M-%S"),
-            "role": request["role"] if "role" in request else "all",
-            "signatory":"unautherized",
-            "autherized": False,
-            "room_id": (request["room_id"] if "room_id" in request else None)})
+        with ALERT_DB_WRITE_LATENCY.time(table="urgent"):
+            doc_id = self.urgent_table.insert({
+                'message': request["message"],
+                "timestamp": datetime.now().strftime("%Y-%m-%d_%H-%M-%S"),
+                "role": request["role"] if "role" in request else "all",
+                "signatory":"unautherized",
+                "autherized": False,
+                "room_id": (request["room_id"] if "room_id" in request else None)})
         self.to_be_autherized.append(doc_id)
         self.last_ids['urgent'] = doc_id
     
@@ -46,16 +48,27 @@ class TinyDBAlertSystem:
         return alerts
 
     def autherize(self, _id, signatory):
-        self.urgent_table.update({"autherized": True, "signatory": signatory}, doc_ids=[_id])
+        """Autherize an urgent alert.
+
+        Returns:
+            dict: the alert, None if there is no such alert.
+        """
+        with ALERT_DB_WRITE_LATENCY.time(table="urgent"):
+            self.urgent_table.update({"autherized": True, "signatory": signatory}, doc_ids=[_id])
+        if _id in self.to_be_autherized:
+            self.to_be_autherized.remove(_id)
+        return self.urgent_table.get(doc_id=_id)
 
     def register_warning_alert(self, request):
         """Register a new warning alert."""
-        doc_id = self.warnings_table.insert({'message': request["message"], "timestamp": datetime.now().strftime("%Y-%m-%d_%H-%M-%S"), "role": request["role"] if "role" in request else "all"})
+        with ALERT_DB_WRITE_LATENCY.time(table="warnings"):
+            doc_id = self.warnings_table.insert({'message': request["message"], "timestamp": datetime.now().strftime("%Y-%m-%d_%H-%M-%S"), "role": request["role"] if "role" in request else "all"})
         self.last_ids['warnings'] = doc_id
 
     def register_information_alert(self, request):
         """Register a new information alert."""
-        doc_id = self.information_table.insert({'message': request["message"], "timestamp": datetime.now().strftime("%Y-%m-%d_%H-%M-%S"), "role": request["role"] if "role" in request else "all"})
+        with ALERT_DB_WRITE_LATENCY.time(table="information"):
+            doc_id = self.information_table.insert({'message': request["message"], "timestamp": datetime.now().strftime("%Y-%m-%d_%H-%M-%S"), "role": request["role"] if "role" in request else "all"})
         self.last_ids['information'] = doc_id
 
     def get_newest_urgent_alert(self):
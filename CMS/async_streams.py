@@ -0,0 +1,189 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+
+The audio and translation websockets on asyncio.
+
+a flask websocket holds a server thread for as long as it is connected, and the client's next
+message waits until the previous one was recognized or translated. here every connection is a
+coroutine on one event loop (its own thread), so idle connections cost almost nothing, and the
+recognition and translation run on a bounded thread pool shared by all connections. messages are
+pipelined: the next messages are received while the previous ones are still processed, up to
+CMS_ASYNC_PIPELINE_DEPTH per connection, after which the connection is not read until one finishes.
+replies are always sent in the order of the messages.
+
+the same paths as the flask websockets are served, on CMS_ASYNC_WS_PORT:
+    /audio          a whole wav file per message, the transcript is sent back.
+    /audio/stream   streamed PCM, partial and final transcripts are sent back (see server.audio_stream).
+    /translate      text per message, the english translation is sent back.
+"""
+import os
+import json
+import asyncio
+import threading
+import traceback
+import importlib.util
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import logger
+from .translater.speech import StreamingRecognizer, get_asr_backend, transcribe_wav
+if "CMS_ACTIVE" in os.environ:
+    from .translater.translation import translation_service
+
+ASYNC_WS_PORT = int(os.environ.get("CMS_ASYNC_WS_PORT", 8782))
+# threads recognizing and translating, for all connections together.
+ASYNC_WORKERS = int(os.environ.get("CMS_ASYNC_WORKERS", 4))
+# messages of one connection being processed or waiting to be, before it is not read anymore.
+PIPELINE_DEPTH = int(os.environ.get("CMS_ASYNC_PIPELINE_DEPTH", 4))
+
+#region sessions
+# the messages of one connection, shared with the flask websockets so both speak the same protocol.
+# handle(message) is blocking, and returns the messages to send back.
+class Session(ABC):
+    stateful = False
+
+    @abstractmethod
+    def handle(self, message) -> list:
+        """process one message (str or bytes), blocking."""
+
+    def handle_safely(self, message) -> list:
+        """handle, but a failure (e.g. the translation API being unreachable) is sent back as
+        {"type": "error", "message": str} instead of ending the connection."""
+        try:
+            return self.handle(message)
+        except Exception as e:
+            logger.error(f"{type(self).__name__} could not handle a message: {traceback.format_exc()}")
+            return [json.dumps({"type": "error", "message": f"{type(e).__name__}: {e}"})]
+
+class AudioSession(Session):
+    """/audio, a whole wav file per message."""
+
+    def handle(self, message) -> list:
+        return [transcribe_wav(message) or "Could not understand audio"]
+
+class AudioStreamSession(Session):
+    """/audio/stream, 16 bit mono PCM as binary messages, json control messages as text."""
+    stateful = True
+
+    def __init__(self):
+        self.recognizer = StreamingRecognizer(get_asr_backend())
+
+    def handle(self, message) -> list:
+        if isinstance(message, bytes):
+            events = self.recognizer.feed(message)
+        else:
+            control = json.loads(message)
+            events = self.recognizer.flush() if (control.get("end") or "sample_rate" in control) else []
+            if "sample_rate" in control:
+                self.recognizer = StreamingRecognizer(self.recognizer.backend, int(control["sample_rate"]))
+        return [json.dumps(event) for event in events]
+
+    def close(self) -> list:
+        return [json.dumps(event) for event in self.recognizer.flush()]
+
+class TranslateSession(Session):
+    """/translate, text per message, translated to english."""
+
+    def handle(self, message) -> list:
+        if isinstance(message, bytes):
+            message = message.decode()
+        return [translation_service.translate(message, dest='en').encode()]
+
+def _close_safely(session):
+    try:
+        return session.close()
+    except Exception:
+        logger.error(f"{type(session).__name__} could not be closed: {traceback.format_exc()}")
+        return []
+
+SESSIONS = {"/audio": AudioSession, "/audio/stream": AudioStreamSession, "/translate": TranslateSession}
+#endregion
+
+class AsyncStreamServer:
+    """The asyncio websocket server, on its own thread with its own event loop."""
+    def __init__(self, host="127.0.0.1", port=ASYNC_WS_PORT, workers=ASYNC_WORKERS, pipeline_depth=PIPELINE_DEPTH):
+        self.host = host
+        self.port = port
+        self.pipeline_depth = pipeline_depth
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="async-ws")
+        self._thread = None
+
+    async def _handle(self, connection):
+        from websockets.exceptions import ConnectionClosed
+
+        path = connection.request.path.split("?")[0]
+        if not path in SESSIONS:
+            await connection.close(4404, "Unknown path")
+            return
+
+        loop = asyncio.get_running_loop()
+        try:
+            session = await loop.run_in_executor(self.executor, SESSIONS[path])
+        except RuntimeError as e:
+            await connection.send(json.dumps({"type": "error", "message": str(e)}))
+            return
+        # jobs in the order of the messages, a full queue stops the reading.
+        pending = asyncio.Queue(maxsize=self.pipeline_depth)
+
+        async def after(previous, message):
+            # the messages of a stateful session are processed one after the other.
+            if previous is not None:
+                await asyncio.wait([previous])
+            return await loop.run_in_executor(self.executor, session.handle_safely, message)
+
+        async def receive():
+            previous = None
+            async for message in connection:
+                if session.stateful:
+                    previous = asyncio.ensure_future(after(previous, message))
+                else:
+                    previous = loop.run_in_executor(self.executor, session.handle_safely, message)
+                await pending.put(previous)
+            # only when the client closed, send() is still draining the queue then. when this task
+            # is cancelled send() already failed, and waiting for room in the queue would never end.
+            await pending.put(None)
+
+        async def send():
+            while (job := await pending.get()) is not None:
+                for reply in await job:
+                    await connection.send(reply)
+            if hasattr(session, "close"):
+                for reply in await loop.run_in_executor(self.executor, _close_safely, session):
+                    await connection.send(reply)
+
+        try:
+            async with asyncio.TaskGroup() as group:
+                group.create_task(receive())
+                group.create_task(send())
+        except* Exception as group_error:
+            if not all(isinstance(error, ConnectionClosed) for error in group_error.exceptions):
+                logger.error(f"During websocket {path}, There was an error: \n" + "".join(traceback.format_exception(group_error)))
+
+    async def _serve(self):
+        from websockets.asyncio.server import serve
+
+        # reuse_port, so every prefork worker can serve on the same port.
+        async with serve(self._handle, self.host, self.port, reuse_port=True, max_size=2**24) as server:
+            logger.info(f"Async websockets serving on {self.host}:{self.port}: {list(SESSIONS)}")
+            await server.serve_forever()
+
+    def _run(self):
+        try:
+            asyncio.run(self._serve())
+        except:
+            logger.error(f"The async websocket server stopped: {traceback.format_exc()}")
+
+    def start(self):
+        """start serving in the background.
+
+        Returns:
+            bool: False if the websockets package is not installed.
+        """
+        if importlib.util.find_spec("websockets") is None:
+            logger.warning("websockets is not installed, the audio and translation websockets are only served by flask.")
+            return False
+        self._thread = threading.Thread(target=self._run, name="async-websockets", daemon=True)
+        self._thread.start()
+        return True
@@ -0,0 +1,169 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+"""
+import os
+import time
+import queue
+import threading
+import traceback
+from types import SimpleNamespace
+from concurrent.futures import Future
+
+import yaml
+import torch
+from ultralytics.trackers.bot_sort import BOTSORT
+from ultralytics.trackers.byte_tracker import BYTETracker
+from ultralytics.utils.checks import check_yaml
+
+from .utils import logger
+from .metrics import INFERENCE_LATENCY, DETECTOR_BATCH_SIZE
+from .threads import pin_current_thread, DETECTOR_CORES
+
+# seconds the first frame of a batch waits for frames of other rooms.
+BATCH_WINDOW = float(os.environ.get("CMS_BATCH_WINDOW", 0.01))
+# frames run through the model at once, at most.
+MAX_BATCH_SIZE = int(os.environ.get("CMS_MAX_BATCH_SIZE", 8))
+# seconds a caller waits for its detection, at most.
+DETECTOR_TIMEOUT = float(os.environ.get("CMS_DETECTOR_TIMEOUT", 30))
+
+class BatchedDetector:
+    """Front end of a yolo model shared by every room.
+
+    frames from any thread are queued, and a single worker runs whatever arrived within
+    BATCH_WINDOW as one batch, then hands every caller its own result. Besides amortizing the
+    per call overhead of the model this means the model is only ever used by one thread.
+    """
+    def __init__(self, model, name, window=BATCH_WINDOW, max_batch_size=MAX_BATCH_SIZE):
+        self.model = model
+        self.name = name
+        self.window = window
+        self.max_batch_size = max_batch_size
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_running(self):
+        with self._lock:
+            # a forked worker does not inherit the thread, start its own.
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name=f"detector-{self.name}", daemon=True)
+                self._thread.start()
+
+    def submit(self, frame, **kwargs):
+        """Queue a frame for detection.
+
+        Args:
+            frame (numpy.ndarray): the cv2 image.
+            **kwargs: arguments of the model call (conf, classes, ...), frames are only
+            batched with frames which have the same arguments.
+
+        Returns:
+            concurrent.futures.Future: resolves to the ultralytics Results of the frame.
+        """
+        self._ensure_running()
+        future = Future()
+        self._queue.put((frame, kwargs, future))
+        return future
+
+    def __call__(self, frame, **kwargs):
+        return self.submit(frame, **kwargs).result(timeout=DETECTOR_TIMEOUT)
+
+    def predict_many(self, frames, **kwargs):
+        """detect every frame, in as few batches as possible, the results are in the same order."""
+        return [future.result(timeout=DETECTOR_TIMEOUT) for future in [self.submit(frame, **kwargs) for frame in frames]]
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run_batch(self, batch):
+        groups = {}
+        for frame, kwargs, future in batch:
+            groups.setdefault(repr(sorted(kwargs.items())), (kwargs, []))[1].append((frame, future))
+
+        for kwargs, items in groups.values():
+            try:
+                DETECTOR_BATCH_SIZE.observe(len(items), model=self.name)
+                with INFERENCE_LATENCY.time(model=self.name, prompt=""):
+                    results = self.model([frame for frame, _ in items], verbose=False, **kwargs)
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(items, results):
+                future.set_result(result)
+
+    def _run(self):
+        logger.info(f"Starting batched detector: {self.name}")
+        pin_current_thread(DETECTOR_CORES)
+        while True:
+            batch = self._collect()
+            try:
+                self._run_batch(batch)
+            except Exception as e:
+                # the worker must keep running, every room's detection waits on it.
+                logger.error(f"Batched detector {self.name} failed a batch: {traceback.format_exc()}")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+# the trackers ultralytics' tracker configs name in tracker_type.
+TRACKERS = {"botsort": BOTSORT, "bytetrack": BYTETracker}
+_tracker_args = {}
+
+def tracker_args(config="botsort.yaml"):
+    """the settings of an ultralytics tracker config, botsort.yaml is what model.track() uses by default."""
+    if not config in _tracker_args:
+        with open(check_yaml(config)) as f:
+            _tracker_args[config] = SimpleNamespace(**yaml.safe_load(f))
+    return _tracker_args[config]
+
+class RoomTracker:
+    """Tracks objects between the frames of one room, on top of a BatchedDetector.
+
+    model.track(persist=True) keeps one tracker per model, so every room calling it
+    shared (and mixed up) the same tracks, this keeps the tracks of each room apart.
+
+    Args:
+        detector (BatchedDetector): the detector the frames are run through.
+        tracker (str): the ultralytics tracker config, "botsort.yaml" or "bytetrack.yaml".
+    """
+    def __init__(self, detector, tracker="botsort.yaml", frame_rate=30):
+        self.detector = detector
+        args = tracker_args(tracker)
+        self.tracker = TRACKERS[args.tracker_type](args, frame_rate=frame_rate)
+        self._lock = threading.Lock()
+
+    def update(self, frame, result):
+        """Advance the tracks with the detections of the next frame.
+
+        Returns:
+            ultralytics Results: the result with track ids (boxes.id), left as is if nothing is tracked.
+        """
+        detections = result.boxes.cpu().numpy()
+        if len(detections) == 0:
+            return result
+        with self._lock:
+            tracks = self.tracker.update(detections, frame)
+        if len(tracks) == 0:
+            return result
+        result = result[tracks[:, -1].astype(int)]
+        result.update(boxes=torch.as_tensor(tracks[:, :-1]))
+        return result
+
+    def __call__(self, frame, conf=0.1, **kwargs):
+        """detect and track, like model.track(frame, persist=True, ...)[0]."""
+        # the tracker needs the low confidence detections as well, as model.track does.
+        return self.update(frame, self.detector(frame, conf=conf, **kwargs))
@@ -0,0 +1,120 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+"""
+import os
+import time
+import threading
+import numpy as np
+
+# the density grid is DENSITY_GRID x DENSITY_GRID cells, whatever the camera resolution.
+DENSITY_GRID = int(os.environ.get("CMS_DENSITY_GRID", 32))
+
+# (seconds per bucket, buckets kept): 5 minutes of seconds, a day of minutes, 30 days of hours.
+RESOLUTIONS = ((1, 300), (60, 24 * 60), (3600, 30 * 24))
+
+class Bucket:
+    __slots__ = ("start", "samples", "occupancy_sum", "peak", "grid_sum")
+
+    def __init__(self, start, grid_shape):
+        self.start = start
+        self.samples = 0
+        self.occupancy_sum = 0.0
+        self.peak = 0
+        self.grid_sum = np.zeros(grid_shape, dtype=np.float32)
+
+class RingBuffer:
+    """Fixed number of buckets of a fixed width, the oldest bucket is reused for the newest."""
+    def __init__(self, width, capacity, grid_shape):
+        self.width = width
+        self.capacity = capacity
+        self.grid_shape = grid_shape
+        self.buckets: list[Bucket] = [None] * capacity
+
+    def add(self, timestamp, occupancy, grid):
+        start = int(timestamp // self.width) * self.width
+        index = (start // self.width) % self.capacity
+        bucket = self.buckets[index]
+        if (bucket is None) or (bucket.start != start):
+            bucket = self.buckets[index] = Bucket(start, self.grid_shape)
+        bucket.samples += 1
+        bucket.occupancy_sum += occupancy
+        bucket.peak = max(bucket.peak, occupancy)
+        bucket.grid_sum += grid
+
+    def since(self, timestamp):
+        """the buckets which overlap [timestamp, now], oldest first."""
+        start = int(timestamp // self.width) * self.width
+        return sorted((bucket for bucket in self.buckets if bucket is not None and bucket.start >= start), key=lambda bucket: bucket.start)
+
+    @property
+    def span(self):
+        return self.width * self.capacity
+
+class DensityHistory:
+    """Time series of the people in a room, kept as fixed resolution density grids in
+    ring buffers of 1 second, 1 minute and 1 hour buckets.
+
+    queries only read buckets, so they cost O(buckets) whatever the frame rate was,
+    and no frames are kept.
+    """
+    def __init__(self, grid_size=DENSITY_GRID, resolutions=RESOLUTIONS):
+        self.grid_shape = (grid_size, grid_size)
+        self.buffers = [RingBuffer(width, capacity, self.grid_shape) for width, capacity in resolutions]
+        self._lock = threading.Lock()
+
+    def record(self, points, width, height, timestamp=None):
+        """Record one analyzed frame.
+
+        Args:
+            points (list[tuple[int, int]]): centers of the people in the frame, in pixels.
+            width (int): width of the frame.
+            height (int): height of the frame.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        grid = np.zeros(self.grid_shape, dtype=np.float32)
+        rows, cols = self.grid_shape
+        for x, y in points:
+            row, col = int(y / height * rows), int(x / width * cols)
+            if 0 <= row < rows and 0 <= col < cols:
+                grid[row, col] += 1
+
+        with self._lock:
+            for buffer in self.buffers:
+                buffer.add(timestamp, len(points), grid)
+
+    def _buckets(self, window, now=None):
+        """the buckets of the finest resolution which still covers the window."""
+        now = time.time() if now is None else now
+        buffer = next((buffer for buffer in self.buffers if buffer.span >= window), self.buffers[-1])
+        with self._lock:
+            return buffer, buffer.since(now - window)
+
+    def average_occupancy(self, window, now=None):
+        """average number of people over the last window seconds, None if nothing was recorded."""
+        _, buckets = self._buckets(window, now)
+        samples = sum(bucket.samples for bucket in buckets)
+        if samples == 0:
+            return None
+        return sum(bucket.occupancy_sum for bucket in buckets) / samples
+
+    def peak_occupancy(self, since, now=None):
+        """highest number of people seen in a single frame since the given timestamp."""
+        now = time.time() if now is None else now
+        _, buckets = self._buckets(now - since, now)
+        return max((bucket.peak for bucket in buckets), default=None)
+
+    def heatmap(self, window, now=None):
+        """average number of people per grid cell over the last window seconds."""
+        _, buckets = self._buckets(window, now)
+        samples = sum(bucket.samples for bucket in buckets)
+        grid = np.zeros(self.grid_shape, dtype=np.float32)
+        for bucket in buckets:
+            grid += bucket.grid_sum
+        return grid / samples if samples else grid
+
+    def series(self, window, now=None):
+        """the buckets covering the window, as (start, average occupancy, peak occupancy)."""
+        buffer, buckets = self._buckets(window, now)
+        return buffer.width, [(bucket.start, bucket.occupancy_sum / bucket.samples, bucket.peak) for bucket in buckets if bucket.samples]
@@ -0,0 +1,80 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+"""
+import os
+import traceback
+import importlib.util
+from functools import partial
+from ultralytics import YOLO
+
+from .utils import logger
+from .threads import onnx_session_options
+
+# "onnx" (onnxruntime), "openvino" or "torch", anything but torch falls back to torch if it can not be used.
+DETECTOR_BACKEND = os.environ.get("CMS_DETECTOR_BACKEND", "onnx")
+
+# what ultralytics names the exported model, next to the .pt file.
+EXPORT_SUFFIXES = {"onnx": ".onnx", "openvino": "_openvino_model"}
+RUNTIME_MODULES = {"onnx": "onnxruntime", "openvino": "openvino"}
+
+def _exported_path(weights, backend):
+    return os.path.splitext(weights)[0] + EXPORT_SUFFIXES[backend]
+
+def _apply_onnx_threads(path, predictor):
+    """ultralytics opens the onnxruntime session with the default options, a thread per core.
+    on the first prediction (the session is made then, in the process which runs it), it is
+    opened again with the CMS_ONNX_THREADS budget."""
+    backend = predictor.model
+    session = getattr(backend, "session", None)
+    if getattr(backend, "_cms_onnx_threads", False) or not getattr(backend, "onnx", False):
+        return
+    backend._cms_onnx_threads = True
+    if session is None:
+        logger.warning(f"Could not apply the onnx thread budget to {path}, it runs with the onnxruntime defaults.")
+        return
+    import onnxruntime
+
+    backend.session = onnxruntime.InferenceSession(path, onnx_session_options(), providers=session.get_providers())
+
+def load_detector(weights, backend=DETECTOR_BACKEND):
+    """Load a yolo model to run on the given backend.
+
+    the weights are exported to the backend's format the first time (or when the .pt file is newer
+    than the export), the export is kept next to the .pt file and used from then on.
+    the returned model is an ultralytics YOLO either way, so results look the same for every backend.
+    onnx sessions get the CMS_ONNX_THREADS budget, openvino keeps its own thread defaults.
+
+    Args:
+        weights (str): path of the .pt file.
+        backend (str): "onnx", "openvino" or "torch".
+
+    Returns:
+        ultralytics.YOLO: the model, on pytorch if the backend is not installed or the export failed.
+    """
+    model = YOLO(weights)
+    if backend == "torch":
+        return model
+    if not backend in EXPORT_SUFFIXES:
+        logger.warning(f"Unknown detector backend {backend}, running {weights} with pytorch.")
+        return model
+    if importlib.util.find_spec(RUNTIME_MODULES[backend]) is None:
+        logger.warning(f"{RUNTIME_MODULES[backend]} is not installed, running {weights} with pytorch.")
+        return model
+
+    exported = _exported_path(weights, backend)
+    try:
+        if (not os.path.exists(exported)) or (os.path.getmtime(exported) < os.path.getmtime(weights)):
+            logger.info(f"Exporting {weights} to {backend}, this is only done once.")
+            # dynamic axes, so frames of any size and batches of any size can be run.
+            exported = model.export(format=backend, dynamic=True)
+        detector = YOLO(exported, task=model.task)
+        if backend == "onnx":
+            detector.add_callback("on_predict_start", partial(_apply_onnx_threads, exported))
+    except Exception:
+        logger.error(f"Could not load {weights} with {backend}, running it with pytorch: {traceback.format_exc()}")
+        return model
+
+    logger.info(f"Running {weights} with {backend}: {exported}")
+    return detector
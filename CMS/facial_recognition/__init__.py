@@ -12,6 +12,9 @@ if "CMS_ACTIVE" in os.environ:
         downloaded_file = hf_hub_download(repo_id="AdamCodd/YOLOv11n-face-detection", filename="model.pt", local_dir=".", local_dir_use_symlinks=False)
         os.rename(downloaded_file, os.path.join(os.getcwd(), "face-detection.pt"))
 
-    from ultralytics import YOLO
+    from ..batching import BatchedDetector
+    from ..detectors import load_detector
 
-    model = YOLO("face-detection.pt")
\ No newline at end of file
+    model = load_detector("face-detection.pt")
+    # every room's frames go through this, so they are batched together.
+    face_detector = BatchedDetector(model, "face-detection")
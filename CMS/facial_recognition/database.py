@@ -8,15 +8,26 @@ import traceback
 import os
 from datetime import datetime
 from ..utils import logger, cv2image_to_base64
+from ..metrics import FACE_MATCH_LATENCY, batch_size_label
 from tinydb import TinyDB, Query
 import face_recognition
+from face_recognition import api as face_api
+import dlib
 import numpy as np
 
+ENCODING_SIZE = 128
+
 class FaceDatabase:
     def __init__(self, db_path='face_db.json'):
+        self.db_path = db_path
         self.db = TinyDB(db_path)
         self.face_table = self.db.table('faces')
         self.query = Query()
+
+        # (records, encodings matrix, squared norms of the encodings), rebuilt when a face is added.
+        # also rebuilt when the file changed, a face may have been added by another prefork worker.
+        self._encodings_cache = None
+        self._encodings_stamp = None
     
     def _encode_face(self, image, *args, **kwargs):
         encodings = face_recognition.face_encodings(image, *args, **kwargs)
@@ -24,6 +35,48 @@ class FaceDatabase:
             return None
         return encodings[0]
 
+    def encode_faces(self, image, face_locations, num_jitters=1):
+        """Encode every face in a frame with a single batched call to dlib.
+
+        Args:
+            image (numpy.ndarray): the RGB frame.
+            face_locations (list): face locations as (top, right, bottom, left), e.g. from yolo.
+
+        Returns:
+            numpy.ndarray: (N, 128) array of encodings, one row per face location.
+        """
+        if len(face_locations) == 0:
+            return np.empty((0, ENCODING_SIZE))
+        # the 5 point landmarks, like face_recognition.face_encodings (model="small") which made the stored encodings.
+        landmarks = dlib.full_object_detections([
+            face_api.pose_predictor_5_point(image, dlib.rectangle(int(left), int(top), int(right), int(bottom)))
+            for top, right, bottom, left in face_locations])
+        return np.array(face_api.face_encoder.compute_face_descriptor(image, landmarks, num_jitters))
+
+    def encode_face_crops(self, crops, num_jitters=1):
+        """Encode a list of face crops with a single batched call to dlib, every crop is assumed
+        to be a whole face (e.g. a yolo detection), so no face detection is run on the crops.
+
+        Args:
+            crops (list[numpy.ndarray]): RGB crops of faces.
+
+        Returns:
+            numpy.ndarray: (N, 128) array of encodings, rows of crops which are empty are NaN.
+        """
+        encodings = np.full((len(crops), ENCODING_SIZE), np.nan)
+        valid = [i for i, crop in enumerate(crops) if crop.size != 0]
+        if len(valid) == 0:
+            return encodings
+
+        images = [np.ascontiguousarray(crops[i]) for i in valid]
+        landmarks = [dlib.full_object_detections([
+            face_api.pose_predictor_5_point(image, dlib.rectangle(0, 0, image.shape[1] - 1, image.shape[0] - 1))])
+            for image in images]
+        descriptors = face_api.face_encoder.compute_face_descriptor(images, landmarks, num_jitters)
+        for i, descriptor in zip(valid, descriptors):
+            encodings[i] = np.array(descriptor[0])
+        return encodings
+
     def add_face(self, image, unique_key, is_admin=False,room_access=[], name='', desc=''):
         """
         Store a face from CCTV footage with a unique identifier
@@ -46,47 +99,84 @@ class FaceDatabase:
                 'image_data': cv2image_to_base64(image),
                 'timestamp': datetime.now().isoformat()
             })
+            self._encodings_cache = None
             return True
             
         except Exception as e:
             logger.error(f"Error while adding faces to database: {traceback.format_exc()}")
             return False
 
-    def find_match(self, encoding, tolerance=0.6):
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.db_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _stored_encodings(self):
+        stamp = self._file_stamp()
+        if self._encodings_cache is None or stamp != self._encodings_stamp:
+            self._encodings_stamp = stamp
+            records = self.face_table.all()
+            stored = np.array([record['face_encoding'] for record in records], dtype=np.float64).reshape(len(records), ENCODING_SIZE)
+            self._encodings_cache = (records, stored, np.einsum("ij,ij->i", stored, stored))
+        return self._encodings_cache
+
+    def _record_to_match(self, record):
+        return {
+            'unique_key': record['unique_key'],
+            'image': record['image_data'],
+            'timestamp': record['timestamp'],
+            "name": record["name"],
+            "desc": record["desc"],
+            "admin": record.get("admin", False),
+            "rooms_access": record.get("rooms_access", []),
+            "encoding": record["face_encoding"]
+        }
+
+    def find_matches(self, encodings, tolerance=0.6, return_distances=False):
         """
-        Check if a face from CCTV footage exists in the database
-        Returns matching record or None
+        Match a batch of face encodings against the database in one vectorized query.
+        Returns a list with the closest matching record (within tolerance) or None for every encoding,
+        if return_distances the distance to the closest record is returned as well (inf if the database
+        is empty, nan if the encoding is invalid).
         """
         try:
-            # Get all stored faces
-            records = self.face_table.all()
-            
-            # Convert stored encodings to numpy arrays
-            stored_encodings = [np.array(record['face_encoding']) for record in records]
-            
-            # Find matches
-            matches = face_recognition.compare_faces(
-                stored_encodings, 
-                encoding, 
-                tolerance=tolerance
-            )
-            
-            # Return first match with original data
-            for match, record in zip(matches, records):
-                if match:
-                    return {
-                        'unique_key': record['unique_key'],
-                        'image': record['image_data'],
-                        'timestamp': record['timestamp'],
-                        "name": record["name"],
-                        "desc": record["desc"],
-                        "encoding": record["face_encoding"]
-                    }
-            return None
-            
+            records, stored, stored_sq = self._stored_encodings()
+            encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, ENCODING_SIZE)
+            results = [None] * len(encodings)
+            nearest = np.full(len(encodings), np.inf)
+            if len(records) == 0 or len(encodings) == 0:
+                return (results, nearest) if return_distances else results
+
+            with FACE_MATCH_LATENCY.time(faces=batch_size_label(len(encodings))):
+                # |a - b|^2 = |a|^2 + |b|^2 - 2ab, avoids building an (N, M, 128) array.
+                distances = np.einsum("ij,ij->i", encodings, encodings)[:, None] + stored_sq[None, :] - 2 * (encodings @ stored.T)
+                distances = np.sqrt(np.maximum(distances, 0))
+
+                for i, row in enumerate(distances):
+                    if np.isnan(row[0]):
+                        nearest[i] = np.nan
+                        continue
+                    best = int(np.argmin(row))
+                    nearest[i] = row[best]
+                    if row[best] <= tolerance:
+                        results[i] = self._record_to_match(records[best])
+            return (results, nearest) if return_distances else results
+
         except Exception as e:
             logger.error(f"Error while finding faces in database: {traceback.format_exc()}")
+            results = [None] * len(encodings)
+            return (results, np.full(len(encodings), np.nan)) if return_distances else results
+
+    def find_match(self, encoding, tolerance=0.6):
+        """
+        Check if a face from CCTV footage exists in the database
+        Returns matching record or None
+        """
+        if encoding is None:
             return None
+        return self.find_matches([encoding], tolerance)[0]
     
     def compare_face(self, face1, face2, tol=0.6):
         return face_recognition.compare_faces(face1, face2, tolerance=tol)[0]
@@ -0,0 +1,81 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+"""
+import os
+import time
+import numpy as np
+
+# seconds after which a resolved identity is recognized again.
+IDENTITY_MAX_AGE = float(os.environ.get("CMS_IDENTITY_MAX_AGE", 10))
+# identities resolved with a confidence below this are recognized again on the next frame.
+IDENTITY_MIN_CONFIDENCE = float(os.environ.get("CMS_IDENTITY_MIN_CONFIDENCE", 0.25))
+# seconds after which a track which is no longer seen is forgotten.
+IDENTITY_TRACK_TIMEOUT = float(os.environ.get("CMS_IDENTITY_TRACK_TIMEOUT", 30))
+
+class IdentityCache:
+    """Resolved identities of the faces in a room, keyed by the tracker id yolo gives them.
+
+    a face only has to be recognized when its track is new, when it was resolved with a
+    low confidence, or when the resolved identity is older than max_age.
+    """
+    def __init__(self, max_age=IDENTITY_MAX_AGE, min_confidence=IDENTITY_MIN_CONFIDENCE, track_timeout=IDENTITY_TRACK_TIMEOUT):
+        self.max_age = max_age
+        self.min_confidence = min_confidence
+        self.track_timeout = track_timeout
+
+        self._entries: dict[int, dict] = {}
+
+    @staticmethod
+    def confidence(distance, tolerance=0.6):
+        """How far the match distance is from the tolerance, 0 on the decision boundary and 1 when certain.
+
+        Args:
+            distance (float): distance to the closest face in the database, inf if there are none.
+            tolerance (float): the tolerance the match was made with.
+
+        Returns:
+            float: confidence between 0 and 1.
+        """
+        if np.isnan(distance):
+            return 0.0
+        return float(min(1.0, abs(tolerance - distance) / tolerance))
+
+    def needs_recognition(self, track_id, now=None):
+        if track_id is None:
+            return True
+        entry = self._entries.get(track_id)
+        if entry is None:
+            return True
+        now = time.time() if now is None else now
+        return (entry["confidence"] < self.min_confidence) or (now - entry["resolved_at"] > self.max_age)
+
+    def get(self, track_id, now=None):
+        """get the cached identity of a track, and mark the track as seen."""
+        entry = self._entries.get(track_id)
+        if entry is None:
+            return None
+        entry["seen_at"] = time.time() if now is None else now
+        return entry["identity"]
+
+    def update(self, track_id, identity, confidence, now=None):
+        now = time.time() if now is None else now
+        self._entries[track_id] = {
+            "identity": identity,
+            "confidence": confidence,
+            "resolved_at": now,
+            "seen_at": now,
+        }
+
+    def prune(self, now=None):
+        """forget the tracks which have not been seen for track_timeout seconds."""
+        now = time.time() if now is None else now
+        for track_id in [track_id for track_id, entry in self._entries.items() if now - entry["seen_at"] > self.track_timeout]:
+            del self._entries[track_id]
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -9,7 +9,7 @@ import os
 
 from ..utils import logger
 if "CMS_ACTIVE" in os.environ:
-    from . import model
+    from . import face_detector
 
 def crop_yolo_detections(image, detections):
     """
@@ -54,7 +54,7 @@ def crop_yolo_detections(image, detections):
     return cropped_images
 
 def segment_faces_from_image(image):
-    _results = [result.boxes.xywhn.detach().cpu().numpy().tolist() for result in model(image)]
+    _results = [face_detector(image).boxes.xywhn.detach().cpu().numpy().tolist()]
     results = []
     for res in _results:
         results.extend(res)
@@ -4,27 +4,31 @@ Github: github.com/Fakesum
 Repo: github.com/Thinkodes/CMS
 """
 import os
+import numpy as np
 if "CMS_ACTIVE" in os.environ:
-    from . import model
+    from . import face_detector
     from .database import face_database
 from .segmentor import crop_yolo_detections
 from ..utils import logger
 
-def track_faces(frame):
-    return model.track(frame,
-        persist=True,  # For tracking between frames
-        classes=[0],
-        verbose=False,
-    )[0]
+def track_faces(frame, tracker):
+    """detect and track the faces in the frame.
+
+    Args:
+        tracker (RoomTracker): the face tracker of the room the frame is from.
+    """
+    return tracker(frame, classes=[0])
 
 def find_all_faces(frame):
-    _results = [result.boxes.xywhn.detach().cpu().numpy().tolist() for result in model(frame)]
+    _results = [face_detector(frame).boxes.xywhn.detach().cpu().numpy().tolist()]
     results = []
     for res in _results:
         results.extend(res)
     
     images = crop_yolo_detections(frame, results)
+    encodings = face_database.encode_face_crops(images)
     _results = []
     for i in range(len(results)):
-        _results.append({"yolo_result": results[i], "encoding": face_database._encode_face(images[i])})
+        encoding = encodings[i]
+        _results.append({"yolo_result": results[i], "encoding": None if np.isnan(encoding[0]) else encoding})
     return _results
\ No newline at end of file
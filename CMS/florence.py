@@ -6,48 +6,157 @@ Repo: github.com/Thinkodes/CMS
 import time
 import cv2
 import torch
+import hashlib
+import threading
+import numpy as np
 from PIL import Image
 import os
-from transformers import AutoModelForCausalLM, AutoProcessor
+from collections import OrderedDict
+from transformers import AutoConfig, AutoModelForCausalLM, AutoProcessor
 
-from .utils import logger
+from .utils import logger, DetectionPrompts
+from .metrics import INFERENCE_LATENCY
+from .florence_runtime import load_florence_runtime
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+dtype = torch.float16 if torch.cuda.is_available() else torch.float32
 
 FLORENCE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "Florence-2-base-ft")
 
-if "CMS_ACTIVE" in os.environ:
-    florence_model = AutoModelForCausalLM.from_pretrained(
+# dynamically quantize the linear layers of the language model (encoder and decoder) to int8, cpu only.
+FLORENCE_QUANTIZE = "CMS_FLORENCE_QUANTIZE" in os.environ
+# the quantized weights are kept here, so the model is only quantized once.
+QUANTIZED_PATH = os.path.join(FLORENCE_PATH, "model-int8.pt")
+
+# "torch", or "onnx" to export florence once to FLORENCE_ONNX_PATH and run it with onnxruntime.
+FLORENCE_BACKEND = os.environ.get("CMS_FLORENCE_BACKEND", "torch")
+FLORENCE_ONNX_PATH = FLORENCE_PATH + "-onnx"
+
+def _weights_mtime():
+    """when the florence weights (or its config) last changed."""
+    names = [name for name in os.listdir(FLORENCE_PATH)
+             if name.endswith((".safetensors", ".bin")) or name == "config.json"]
+    return max((os.path.getmtime(os.path.join(FLORENCE_PATH, name)) for name in names), default=0)
+
+def _quantize(model):
+    model.language_model = torch.ao.quantization.quantize_dynamic(model.language_model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+def load_florence(quantize=FLORENCE_QUANTIZE):
+    """Load florence, on the gpu in float16 if there is one.
+
+    Args:
+        quantize (bool): int8 linear layers in the language model, ignored on gpu.
+        the first time the model is quantized and saved to QUANTIZED_PATH, later loads use the saved weights,
+        until the florence weights are newer than them, then the model is quantized again.
+    """
+    if quantize and torch.cuda.is_available():
+        logger.warning("Florence quantization is only for cpu, loading the float16 model.")
+        quantize = False
+
+    cached = quantize and os.path.exists(QUANTIZED_PATH)
+    if cached and os.path.getmtime(QUANTIZED_PATH) < _weights_mtime():
+        logger.info(f"The florence weights are newer than {QUANTIZED_PATH}, quantizing them again.")
+        cached = False
+    if cached:
+        logger.info(f"Loading quantized florence from {QUANTIZED_PATH}")
+        config = AutoConfig.from_pretrained(FLORENCE_PATH, trust_remote_code=True, local_files_only=True)
+        # the weights of the model are replaced by the saved ones, the float32 weights are never read.
+        model = _quantize(AutoModelForCausalLM.from_config(config, trust_remote_code=True))
+        # the packed int8 weights are pickled objects, which weights_only (the default since torch 2.6) refuses.
+        model.load_state_dict(torch.load(QUANTIZED_PATH, weights_only=False))
+        return model.eval()
+
+    model = AutoModelForCausalLM.from_pretrained(
         FLORENCE_PATH,
-        torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+        torch_dtype=dtype,
         trust_remote_code=True,
         local_files_only=True
     ).to(device)
-    florence_processor = AutoProcessor.from_pretrained(FLORENCE_PATH, trust_remote_code=True, local_files_only=True)
+    if quantize:
+        logger.info(f"Quantizing florence, saving it to {QUANTIZED_PATH}")
+        model = _quantize(model)
+        torch.save(model.state_dict(), QUANTIZED_PATH)
+    return model.eval()
+
+def load_florence_processor():
+    return AutoProcessor.from_pretrained(FLORENCE_PATH, trust_remote_code=True, local_files_only=True)
+
+if "CMS_ACTIVE" in os.environ:
+    florence_processor = load_florence_processor()
+    if FLORENCE_BACKEND == "onnx":
+        # the runtime is used in place of the model, florence_model.generate is the same call.
+        florence_model = load_florence_runtime(lambda: load_florence(quantize=False), florence_processor, FLORENCE_ONNX_PATH, FLORENCE_QUANTIZE)
+    else:
+        florence_model = load_florence()
+
+# prompts given to florence by CMS itself, any other prompt is reported as "custom" in the metrics.
+KNOWN_PROMPTS = {value for name, value in vars(DetectionPrompts).items() if not name.startswith("_")} | {"how many people?"}
+
+# preprocessed frames kept, every prompt about the same frame shares its pixel values.
+PIXEL_CACHE_SIZE = int(os.environ.get("CMS_FLORENCE_PIXEL_CACHE", 16))
+PROMPT_CACHE_SIZE = 256
+
+_pixel_cache = OrderedDict()
+_prompt_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _lru_get(cache, key, compute, size):
+    with _cache_lock:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+    value = compute()
+    with _cache_lock:
+        cache[key] = value
+        while len(cache) > size:
+            cache.popitem(last=False)
+    return value
+
+def frame_key(cv2_image):
+    """a key for the frame from its content, for frames which do not come with one."""
+    return (cv2_image.shape, hashlib.blake2b(np.ascontiguousarray(cv2_image).data, digest_size=16).digest())
+
+def pixel_values(cv2_image, key=None):
+    """the image preprocessed for florence (resized, normalized tensor), computed once per key."""
+    def compute():
+        # Convert CV2 image (BGR) to PIL image (RGB)
+        image = Image.fromarray(cv2.cvtColor(cv2_image, cv2.COLOR_BGR2RGB))
+        return florence_processor.image_processor(image, return_tensors="pt")["pixel_values"].to(device, dtype)
+    return _lru_get(_pixel_cache, frame_key(cv2_image) if key is None else key, compute, PIXEL_CACHE_SIZE)
+
+def prompt_ids(prompt):
+    """the tokenized prompt, task prompts are expanded the same way florence_processor does."""
+    def compute():
+        return florence_processor.tokenizer(florence_processor._construct_prompts([prompt]), return_tensors="pt")["input_ids"].to(device)
+    return _lru_get(_prompt_cache, prompt, compute, PROMPT_CACHE_SIZE)
 
 # Function to measure response time and return generated text
-def florence_endpoint(cv2_image, prompts: list[str]) -> list[str]:
+def florence_endpoint(cv2_image, prompts: list[str], model=None, key=None) -> list[str]:
+    """Ask florence every prompt about the image.
+
+    Args:
+        model: the florence model to use, florence_model if None.
+        key: identifies the frame for the preprocessing cache (e.g. room and frame sequence),
+        the frame is hashed if None.
+    """
     global florence_model, florence_processor
-    # Load the model and processor
+    if model is None:
+        model = florence_model
 
     logger.info("starting processing by florence.")
 
-    # Convert CV2 image (BGR) to PIL image (RGB)
-    image = cv2.cvtColor(cv2_image, cv2.COLOR_BGR2RGB)
-    image = Image.fromarray(image)
+    height, width = cv2_image.shape[:2]
+    frame_pixel_values = pixel_values(cv2_image, key)
 
     results = []
 
     for prompt in prompts:
-        # Prepare inputs
-        inputs = florence_processor(text=prompt, images=image, return_tensors="pt").to(device, 
-                                                                                    torch.float16 if torch.cuda.is_available() else torch.float32)
-
         # Measure time taken for generation
         start_time = time.time()
-        generated_ids = florence_model.generate(
-            input_ids=inputs["input_ids"],
-            pixel_values=inputs["pixel_values"],
+        generated_ids = model.generate(
+            input_ids=prompt_ids(prompt),
+            pixel_values=frame_pixel_values,
             max_new_tokens=1024,
             do_sample=False,
             num_beams=3
@@ -56,10 +165,11 @@ def florence_endpoint(cv2_image, prompts: list[str]) -> list[str]:
 
         # Decode the generated text
         generated_text = florence_processor.batch_decode(generated_ids, skip_special_tokens=False)[0]
-        parsed_answer = florence_processor.post_process_generation(generated_text, task=prompt, image_size=(image.width, image.height))
+        parsed_answer = florence_processor.post_process_generation(generated_text, task=prompt, image_size=(width, height))
 
         # Calculate time taken
         time_taken = end_time - start_time
+        INFERENCE_LATENCY.observe(time_taken, model="florence", prompt=prompt if prompt in KNOWN_PROMPTS else "custom")
         logger.debug(f"Time Taken for florence({prompt}): {time_taken}")
         logger.debug(f"Answer from florence({prompt}): {parsed_answer[prompt]}")
         results.append(parsed_answer[prompt])
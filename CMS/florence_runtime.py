@@ -0,0 +1,294 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+"""
+import os
+import json
+import threading
+import traceback
+import importlib.util
+import numpy as np
+import torch
+
+from .utils import logger
+from .threads import onnx_session_options
+
+GRAPHS = ("vision", "encoder", "decoder", "decoder_with_past")
+PAST_NAMES = ("self_key", "self_value", "cross_key", "cross_value")
+OPSET = 17
+
+class _VisionEncoder(torch.nn.Module):
+    """pixel values -> image features, the DaViT vision tower and its projection."""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model._encode_image(pixel_values)
+
+class _TextEncoder(torch.nn.Module):
+    """image features and prompt -> encoder hidden states."""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, image_features, input_ids):
+        inputs_embeds = self.model.get_input_embeddings()(input_ids)
+        inputs_embeds, attention_mask = self.model._merge_input_ids_with_image_features(image_features, inputs_embeds)
+        return self.model.language_model.get_encoder()(inputs_embeds=inputs_embeds, attention_mask=attention_mask).last_hidden_state
+
+class _Decoder(torch.nn.Module):
+    """one decoder step -> logits and the key value cache of every layer, flattened."""
+    def __init__(self, model):
+        super().__init__()
+        self.language_model = model.language_model
+
+    def forward(self, input_ids, encoder_hidden_states, *past):
+        past_key_values = tuple(tuple(past[i:i + len(PAST_NAMES)]) for i in range(0, len(past), len(PAST_NAMES))) or None
+        outputs = self.language_model.get_decoder()(
+            input_ids=input_ids,
+            encoder_hidden_states=encoder_hidden_states,
+            past_key_values=past_key_values,
+            use_cache=True,
+        )
+        logits = self.language_model.lm_head(outputs.last_hidden_state)
+        if hasattr(self.language_model, "final_logits_bias"):
+            logits = logits + self.language_model.final_logits_bias
+        return (logits, *[tensor for layer in outputs.past_key_values for tensor in layer])
+
+def _past_names(prefix, layers):
+    return [f"{prefix}.{layer}.{name}" for layer in range(layers) for name in PAST_NAMES]
+
+def _past_axes(names, sequence_axis):
+    """self attention caches grow with the output, cross attention caches have the length of the input."""
+    return {name: {0: "batch", 2: sequence_axis if "self" in name else "encoder_sequence"} for name in names}
+
+@torch.no_grad()
+def export_florence(model, processor, path):
+    """Export florence to onnx graphs in path, with the generation settings the runtime needs.
+
+    Args:
+        model: the float32 florence model.
+        processor: its processor, used to make example inputs.
+    """
+    from PIL import Image
+
+    os.makedirs(path, exist_ok=True)
+    model = model.float().eval()
+    language_model = model.language_model
+    layers = language_model.config.decoder_layers
+
+    inputs = processor(text="is there fire.", images=Image.new("RGB", (768, 768)), return_tensors="pt")
+    vision = _VisionEncoder(model)
+    image_features = vision(inputs["pixel_values"])
+    torch.onnx.export(vision, (inputs["pixel_values"],), os.path.join(path, "vision.onnx"),
+        input_names=["pixel_values"], output_names=["image_features"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "image_features": {0: "batch"}}, opset_version=OPSET)
+
+    text_encoder = _TextEncoder(model)
+    encoder_hidden_states = text_encoder(image_features, inputs["input_ids"])
+    torch.onnx.export(text_encoder, (image_features, inputs["input_ids"]), os.path.join(path, "encoder.onnx"),
+        input_names=["image_features", "input_ids"], output_names=["encoder_hidden_states"],
+        dynamic_axes={"image_features": {0: "batch"}, "input_ids": {0: "batch", 1: "prompt"}, "encoder_hidden_states": {0: "batch", 1: "encoder_sequence"}},
+        opset_version=OPSET)
+
+    decoder = _Decoder(model)
+    start = torch.full((1, 1), language_model.config.decoder_start_token_id, dtype=torch.long)
+    first = decoder(start, encoder_hidden_states)
+    present = _past_names("present", layers)
+    torch.onnx.export(decoder, (start, encoder_hidden_states), os.path.join(path, "decoder.onnx"),
+        input_names=["input_ids", "encoder_hidden_states"], output_names=["logits", *present],
+        dynamic_axes={"input_ids": {0: "batch", 1: "sequence"}, "encoder_hidden_states": {0: "batch", 1: "encoder_sequence"},
+                      "logits": {0: "batch", 1: "sequence"}, **_past_axes(present, "sequence")},
+        opset_version=OPSET)
+
+    past = _past_names("past", layers)
+    torch.onnx.export(decoder, (start, encoder_hidden_states, *first[1:]), os.path.join(path, "decoder_with_past.onnx"),
+        input_names=["input_ids", "encoder_hidden_states", *past], output_names=["logits", *present],
+        dynamic_axes={"input_ids": {0: "batch"}, "encoder_hidden_states": {0: "batch", 1: "encoder_sequence"},
+                      "logits": {0: "batch"}, **_past_axes(past, "past_sequence"), **_past_axes(present, "sequence")},
+        opset_version=OPSET)
+
+    generation_config = language_model.generation_config
+    with open(os.path.join(path, "runtime.json"), "w") as f:
+        json.dump({
+            "layers": layers,
+            "decoder_start_token_id": language_model.config.decoder_start_token_id,
+            "eos_token_id": language_model.config.eos_token_id,
+            "forced_bos_token_id": generation_config.forced_bos_token_id,
+            "forced_eos_token_id": generation_config.forced_eos_token_id,
+            "no_repeat_ngram_size": generation_config.no_repeat_ngram_size or 0,
+            "length_penalty": generation_config.length_penalty,
+            "early_stopping": bool(generation_config.early_stopping),
+        }, f, indent=2)
+
+def quantize_graphs(path):
+    """write int8 dynamically quantized versions of the text graphs, the vision graph is left float32."""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    for name in ("encoder", "decoder", "decoder_with_past"):
+        quantize_dynamic(os.path.join(path, f"{name}.onnx"), os.path.join(path, f"{name}.int8.onnx"), weight_type=QuantType.QInt8)
+
+def _numpy(tensor):
+    return tensor.detach().cpu().numpy() if hasattr(tensor, "detach") else np.asarray(tensor)
+
+def _log_softmax(logits):
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    return logits - np.log(np.exp(logits).sum(axis=-1, keepdims=True))
+
+class FlorenceRuntime:
+    """Runs exported florence graphs with onnxruntime, and decodes with a beam search over
+    the key value cache in numpy, in place of florence_model.generate.
+    """
+    def __init__(self, path, quantized=False):
+        with open(os.path.join(path, "runtime.json")) as f:
+            self.config = json.load(f)
+        self.path = path
+        self.quantized = quantized
+        self.past = _past_names("past", self.config["layers"])
+
+        self._pid = None
+        self._lock = threading.Lock()
+        self._load_sessions()
+
+    def _load_sessions(self):
+        import onnxruntime
+
+        options = onnx_session_options()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        def session(name):
+            quantized_path = os.path.join(self.path, f"{name}.int8.onnx")
+            graph = quantized_path if self.quantized and os.path.exists(quantized_path) else os.path.join(self.path, f"{name}.onnx")
+            return onnxruntime.InferenceSession(graph, options, providers=["CPUExecutionProvider"])
+
+        self.vision, self.encoder, self.decoder, self.decoder_with_past = (session(name) for name in GRAPHS)
+        self._pid = os.getpid()
+
+    def _ensure_sessions(self):
+        # sessions (and their thread pools) do not survive a fork, a prefork worker makes its own.
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._load_sessions()
+
+    def _process(self, logprobs, tokens, max_length):
+        """the logits processors of florence's generation config, in place."""
+        cur_len = tokens.shape[1]
+        config = self.config
+        if cur_len == 1 and config["forced_bos_token_id"] is not None:
+            logprobs[:] = -np.inf
+            logprobs[:, config["forced_bos_token_id"]] = 0
+        elif cur_len == max_length - 1 and config["forced_eos_token_id"] is not None:
+            logprobs[:] = -np.inf
+            logprobs[:, config["forced_eos_token_id"]] = 0
+
+        n = config["no_repeat_ngram_size"]
+        if n and cur_len >= n:
+            for beam, sequence in enumerate(tokens.tolist()):
+                prefix = sequence[cur_len - n + 1:]
+                banned = [sequence[i + n - 1] for i in range(cur_len - n + 1) if sequence[i:i + n - 1] == prefix]
+                logprobs[beam, banned] = -np.inf
+
+    def _step(self, tokens, encoder_hidden_states, past):
+        if past is None:
+            outputs = self.decoder.run(None, {"input_ids": tokens, "encoder_hidden_states": encoder_hidden_states})
+        else:
+            feed = {"input_ids": tokens[:, -1:], "encoder_hidden_states": encoder_hidden_states}
+            feed.update(zip(self.past, past))
+            outputs = self.decoder_with_past.run(None, feed)
+        return outputs[0][:, -1, :], outputs[1:]
+
+    def beam_search(self, encoder_hidden_states, max_new_tokens=1024, num_beams=3):
+        """Decode one prompt, greedy when num_beams is 1.
+
+        Returns:
+            list[int]: the generated tokens, starting with the decoder start token.
+        """
+        config = self.config
+        eos = config["eos_token_id"]
+        length_penalty = config["length_penalty"]
+        max_length = max_new_tokens + 1
+
+        encoder_hidden_states = np.repeat(encoder_hidden_states, num_beams, axis=0)
+        tokens = np.full((num_beams, 1), config["decoder_start_token_id"], dtype=np.int64)
+        # all beams start the same, only the first one may be expanded.
+        scores = np.full(num_beams, -1e9, dtype=np.float32)
+        scores[0] = 0
+        finished = [] # (normalized score, tokens), best first, at most num_beams.
+        past = None
+
+        while True:
+            logits, past = self._step(tokens, encoder_hidden_states, past)
+            logprobs = _log_softmax(logits.astype(np.float32))
+            self._process(logprobs, tokens, max_length)
+            cur_len = tokens.shape[1]
+
+            candidates = (scores[:, None] + logprobs).reshape(-1)
+            top = np.argpartition(-candidates, 2 * num_beams)[:2 * num_beams]
+            top = top[np.argsort(-candidates[top])]
+
+            beams, next_tokens, next_scores = [], [], []
+            for rank, index in enumerate(top):
+                beam, token = divmod(int(index), logprobs.shape[1])
+                if token == eos:
+                    if rank < num_beams:
+                        finished.append((candidates[index] / cur_len ** length_penalty, tokens[beam].tolist() + [eos]))
+                        finished = sorted(finished, key=lambda hypothesis: -hypothesis[0])[:num_beams]
+                    continue
+                beams.append(beam)
+                next_tokens.append(token)
+                next_scores.append(candidates[index])
+                if len(beams) == num_beams:
+                    break
+
+            if len(finished) == num_beams and (config["early_stopping"] or max(next_scores) / cur_len ** length_penalty <= finished[-1][0]):
+                break
+            if cur_len + 1 >= max_length:
+                break
+
+            tokens = np.concatenate([tokens[beams], np.array(next_tokens, dtype=np.int64)[:, None]], axis=1)
+            scores = np.array(next_scores, dtype=np.float32)
+            past = [cache[beams] for cache in past]
+
+        if finished:
+            return finished[0][1]
+        return tokens[int(np.argmax(scores))].tolist()
+
+    def generate(self, input_ids, pixel_values, max_new_tokens=1024, num_beams=3, **kwargs):
+        """same arguments as florence_model.generate, for one image and prompt.
+
+        Returns:
+            numpy.ndarray: the generated token ids, shape (1, length).
+        """
+        self._ensure_sessions()
+        image_features = self.vision.run(None, {"pixel_values": _numpy(pixel_values).astype(np.float32)})[0]
+        encoder_hidden_states = self.encoder.run(None, {"image_features": image_features, "input_ids": _numpy(input_ids).astype(np.int64)})[0]
+        return np.array([self.beam_search(encoder_hidden_states, max_new_tokens, num_beams)])
+
+def load_florence_runtime(load_model, processor, path, quantize=False):
+    """Load the onnx runtime of florence, exporting the model to path first if it was not yet.
+
+    Args:
+        load_model (callable): loads the float32 florence model, only called to export it or to fall back to it.
+        quantize (bool): use int8 text graphs, quantizing them first if they were not yet.
+
+    Returns:
+        FlorenceRuntime: the runtime, or the pytorch model if onnxruntime is not installed or the export failed.
+    """
+    if importlib.util.find_spec("onnxruntime") is None:
+        logger.warning("onnxruntime is not installed, running florence with pytorch.")
+        return load_model()
+    try:
+        # runtime.json is written after every graph was exported.
+        if not os.path.exists(os.path.join(path, "runtime.json")):
+            logger.info(f"Exporting florence to {path}, this is only done once.")
+            export_florence(load_model(), processor, path)
+        if quantize and not os.path.exists(os.path.join(path, "decoder_with_past.int8.onnx")):
+            logger.info(f"Quantizing the florence graphs in {path}")
+            quantize_graphs(path)
+        runtime = FlorenceRuntime(path, quantize)
+    except Exception:
+        logger.error(f"Could not load the florence onnx runtime, running florence with pytorch: {traceback.format_exc()}")
+        return load_model()
+    logger.info(f"Running florence with onnxruntime from {path}")
+    return runtime
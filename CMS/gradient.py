@@ -4,8 +4,9 @@ Github: github.com/Fakesum
 Repo: github.com/Thinkodes/CMS
 """
 import time
-from ultralytics import YOLO
-from .utils import logger
+from .utils import logger, rate_limited_log
+from .batching import BatchedDetector
+from .detectors import load_detector
 import numpy as np
 import logging
 import cv2
@@ -15,7 +16,9 @@ logger.info("LOADING YOLO...")
 
 # This is not particularly intensive, so load it regardless I guess. Causes much less problems.
 if "CMS_ACTIVE" in os.environ:
-    model = YOLO("yolo11n.pt")  # Specify 'cuda' to use GPU
+    model = load_detector("yolo11n.pt")
+    # every room's frames go through this, so they are batched together.
+    people_detector = BatchedDetector(model, "yolo11n")
 
 # #redirect YOLO Logging
 def __bootstrap_yolo():
@@ -33,23 +36,25 @@ def __bootstrap_yolo():
     # Create a handler to forward YOLO's logs to your logger
     class ForwardingHandler(logging.Handler):
         def emit(self, record):
-            logger.log(record.levelname.upper(), record.getMessage())
+            if record.levelno <= logging.INFO:
+                # yolo logs a line for every inference.
+                rate_limited_log(record.levelname.upper(), record.getMessage(), key="ultralytics")
+            else:
+                # warnings and errors are never hidden behind that line.
+                logger.log(record.levelname.upper(), record.getMessage())
 
     yolo_logger.addHandler(ForwardingHandler())
 
 __bootstrap_yolo()
 
-def create_gradient(image_np, conf=0.5, scale_factor=0.01, _kernel_size=500):
-    st = time.time()
-
-    logger.info("Calculating Gradient.")
+def detect_people(image_np, conf=0.5):
+    """Detect people with yolo.
 
-    height, width, _ = image_np.shape
-
-    # Detect people using YOLOv8
-    results = model(image_np)
+    Returns:
+        list[tuple[int, int]]: the center of every person detected with more than conf confidence.
+    """
     points = []
-    for result in results:
+    for result in [people_detector(image_np)]:
         boxes = result.boxes.xyxy.cpu().numpy()
         confidences = result.boxes.conf.cpu().numpy()
         class_ids = result.boxes.cls.cpu().numpy()
@@ -60,8 +65,10 @@ def create_gradient(image_np, conf=0.5, scale_factor=0.01, _kernel_size=500):
                 center_x = int((x1 + x2) / 2)
                 center_y = int((y1 + y2) / 2)
                 points.append((center_x, center_y))
+    return points
 
-    # Create density map
+def density_grid(points, width, height, scale_factor=0.01):
+    """count the points in a grid scale_factor the size of the image."""
     scaled_width = int(width * scale_factor)
     scaled_height = int(height * scale_factor)
     density_map = np.zeros((scaled_height, scaled_width), dtype=np.float32)
@@ -72,7 +79,10 @@ def create_gradient(image_np, conf=0.5, scale_factor=0.01, _kernel_size=500):
         scaled_y = int(y * scale_factor)
         if 0 <= scaled_x < scaled_width and 0 <= scaled_y < scaled_height:
             density_map[scaled_y, scaled_x] += 1
+    return density_map
 
+def render_density(density_map, width, height, scale_factor=0.01, _kernel_size=500):
+    """blur a density grid and render it as a colored heatmap of the given size."""
     # Apply Gaussian blur
     kernel_size = int(_kernel_size * scale_factor)
     kernel_size = kernel_size + 1 if kernel_size % 2 == 0 else kernel_size
@@ -84,17 +94,34 @@ def create_gradient(image_np, conf=0.5, scale_factor=0.01, _kernel_size=500):
     # Normalize and invert
     density_map = cv2.normalize(density_map, None, 255, 0, cv2.NORM_MINMAX)
     density_map = np.uint8(density_map)
-    
-    import os
 
     # some weirdness where cv2 is activing differently depending on the 
     if os.name == 'nt':
         density_map = cv2.bitwise_not(density_map)
 
-    heatmap = cv2.applyColorMap(density_map, cv2.COLORMAP_JET)
+    return cv2.applyColorMap(density_map, cv2.COLORMAP_JET)
+
+def create_gradient(image_np, conf=0.5, scale_factor=0.01, _kernel_size=500, points=None):
+    """Heatmap of the people in the image.
+
+    Args:
+        points (list): already detected people (see detect_people), to skip the detection.
+    """
+    st = time.time()
+
+    rate_limited_log("INFO", "Calculating Gradient.")
+
+    height, width, _ = image_np.shape
+
+    # Detect people using YOLOv8
+    if points is None:
+        points = detect_people(image_np, conf)
+
+    # Create density map
+    heatmap = render_density(density_grid(points, width, height, scale_factor), width, height, scale_factor, _kernel_size)
     
-    logger.info("Gradient processing completed successfully")
+    rate_limited_log("INFO", "Gradient processing completed successfully")
 
     logger.debug(f"Time Taken for Gradient: {time.time() - st}")
 
-    return heatmap
\ No newline at end of file
+    return heatmap
@@ -81,6 +81,6 @@ def rooms_to_nodes(rooms: dict[str, Room]):
         for conn_id in room.connected_roomids:
             nodes[room_id].add_connection(nodes[conn_id])
     
-    logger.debug(f"Nodes: {nodes}")
+    logger.opt(lazy=True).debug("Nodes: {}", lambda: nodes)
     
     return nodes
\ No newline at end of file
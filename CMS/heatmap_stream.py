@@ -0,0 +1,120 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+"""
+import os
+import time
+import threading
+import traceback
+
+from .gradient import density_grid, render_density
+from .utils import logger, encode_image, IMAGE_FORMATS
+
+# heatmap frames computed per second, for each room that has viewers.
+HEATMAP_FPS = float(os.environ.get("CMS_HEATMAP_FPS", 2))
+# how much of the accumulated density is kept per second, the rest decays away.
+HEATMAP_DECAY = float(os.environ.get("CMS_HEATMAP_DECAY", 0.8))
+# seconds without viewers after which the stream stops computing.
+HEATMAP_IDLE_TIMEOUT = float(os.environ.get("CMS_HEATMAP_IDLE_TIMEOUT", 30))
+
+class HeatmapStream:
+    """A continuously updated heatmap of one room, shared by all of its viewers.
+
+    the density of people is accumulated with exponential decay from the room's frames,
+    encoded once per update, and handed to every viewer, so N viewers cost one computation.
+    the computation only runs while there are viewers.
+    """
+    def __init__(self, room, fps=HEATMAP_FPS, decay=HEATMAP_DECAY, scale_factor=0.01, kernel_size=500, fmt="jpeg", quality=None):
+        self.room = room
+        self.fps = fps
+        self.decay = decay
+        self.scale_factor = scale_factor
+        self.kernel_size = kernel_size
+        self.fmt = fmt
+        self.quality = quality
+
+        self.mimetype = IMAGE_FORMATS[fmt][1]
+        self._density = None
+        self._frame = None
+        self._sequence = 0
+        self._condition = threading.Condition()
+        # when the density was last decayed, it keeps decaying over the time the stream was stopped.
+        self._updated = None
+
+        self._viewers = 0
+        self._last_viewer = time.monotonic()
+        self._thread = None
+        self._alive = True
+
+    def _update(self):
+        if len(self.room.past_frames) == 0:
+            return
+        frame = self.room.past_frames[-1]
+        height, width = frame.shape[:2]
+        points = self.room.person_points()
+        if points is None:
+            return
+
+        density = density_grid(points, width, height, self.scale_factor)
+        now = time.monotonic()
+        elapsed, self._updated = (0 if self._updated is None else now - self._updated), now
+        if (self._density is None) or (self._density.shape != density.shape):
+            self._density = density
+        else:
+            self._density = self._density * (self.decay ** elapsed) + density
+
+        data, _ = encode_image(render_density(self._density, width, height, self.scale_factor, self.kernel_size), self.fmt, self.quality)
+        with self._condition:
+            self._frame = data
+            self._sequence += 1
+            self._condition.notify_all()
+
+    def _run(self):
+        logger.info(f"Starting heatmap stream of room: {self.room._id}")
+        while self._alive:
+            with self._condition:
+                if self._viewers == 0 and time.monotonic() - self._last_viewer > HEATMAP_IDLE_TIMEOUT:
+                    self._thread = None
+                    break
+            st = time.monotonic()
+            try:
+                self._update()
+            except:
+                logger.error(f"Error while updating the heatmap of room {self.room._id}: {traceback.format_exc()}")
+            time.sleep(max(0, 1 / self.fps - (time.monotonic() - st)))
+        logger.info(f"Stopped heatmap stream of room: {self.room._id}")
+
+    def _ensure_running(self):
+        with self._condition:
+            if self._thread is None and self._alive:
+                self._thread = threading.Thread(target=self._run, name=f"heatmap-{self.room._id}", daemon=True)
+                self._thread.start()
+
+    def frames(self, timeout=10):
+        """Yield every new encoded heatmap frame, as long as the caller keeps iterating.
+
+        Args:
+            timeout (float): yield the last frame again if no new frame arrived within timeout seconds,
+            so the caller can notice disconnected clients.
+        """
+        with self._condition:
+            self._viewers += 1
+        try:
+            self._ensure_running()
+            sequence = 0
+            while self._alive:
+                with self._condition:
+                    self._condition.wait_for(lambda: self._sequence != sequence or not self._alive, timeout)
+                    sequence, frame = self._sequence, self._frame
+                if frame is not None:
+                    yield frame
+        finally:
+            with self._condition:
+                self._viewers -= 1
+                self._last_viewer = time.monotonic()
+
+    def stop(self):
+        with self._condition:
+            self._alive = False
+            self._condition.notify_all()
@@ -0,0 +1,135 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+"""
+import os
+import json
+import time
+
+LEVELS = {"TRACE": 5, "DEBUG": 10, "INFO": 20, "SUCCESS": 25, "WARNING": 30, "ERROR": 40, "CRITICAL": 50}
+
+BLOCK_SIZE = 64 * 1024
+
+def line_level(line):
+    """the level of a log line, as written by loguru either as text or json, None for
+    lines which continue the previous record (e.g. tracebacks)."""
+    if line.startswith("{"):
+        try:
+            return json.loads(line)["record"]["level"]["name"]
+        except (ValueError, KeyError, TypeError):
+            return None
+    parts = line.split(" | ", 2)
+    if len(parts) < 3:
+        return None
+    level = parts[1].strip()
+    return level if level in LEVELS else None
+
+class LineFilter:
+    """Filters log lines by minimum level and substring, lines without a level
+    (continuations of multi line records) get the level of the record they belong to."""
+    def __init__(self, level=None, contains=None):
+        self.min_level = LEVELS.get(level.upper(), 0) if level else 0
+        self.contains = contains or None
+        self._current_level = None
+
+    def __call__(self, line):
+        level = line_level(line)
+        if level is not None:
+            self._current_level = level
+        if self.min_level:
+            if (self._current_level is None) or (LEVELS[self._current_level] < self.min_level):
+                return False
+        return (self.contains is None) or (self.contains in line)
+
+def _decode(data):
+    return data.decode("utf-8", errors="replace")
+
+def tail_lines(path, count, level=None, contains=None):
+    """The last count (matching) lines of the file, read backwards from the end
+    in growing blocks so only the tail of the file is read.
+
+    Returns:
+        tuple[list[str], int]: the lines, and the size of the file, which can be used as a cursor.
+    """
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        start = size
+        block = BLOCK_SIZE
+        while True:
+            start = max(0, start - block)
+            f.seek(start)
+            data = f.read(size - start)
+            lines = data.split(b"\n")
+            if lines and lines[-1] == b"":
+                lines.pop()
+            if start > 0:
+                lines = lines[1:] # the first line is probably cut.
+
+            line_filter = LineFilter(level, contains)
+            matching = [line for line in map(_decode, lines) if line_filter(line)]
+            if len(matching) >= count or start == 0:
+                return matching[-count:] if count > 0 else [], size
+            block *= 2
+
+def read_page(path, cursor=0, limit=500, level=None, contains=None):
+    """Read forward from the byte offset cursor, up to limit (matching) lines.
+
+    Returns:
+        tuple[list[str], int, bool]: the lines, the cursor to continue from and whether the end of the file was reached.
+    """
+    line_filter = LineFilter(level, contains)
+    lines = []
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if cursor > size: # the file was rotated.
+            cursor = 0
+        f.seek(cursor)
+        while len(lines) < limit:
+            raw = f.readline()
+            if not raw.endswith(b"\n"): # end of file, or a line still being written.
+                break
+            cursor += len(raw)
+            line = _decode(raw.rstrip(b"\n"))
+            if line_filter(line):
+                lines.append(line)
+    return lines, cursor, cursor >= size
+
+def follow(path, cursor=None, level=None, contains=None, poll_interval=0.5, heartbeat=15):
+    """Yield (cursor, line) for every line appended to the file, and (cursor, None) at least
+    every heartbeat seconds, starts at the end of the file when cursor is None.
+    Follows the file over rotation, as the rotated file is replaced by a new one at path.
+    """
+    line_filter = LineFilter(level, contains)
+    if cursor is None:
+        cursor = os.path.getsize(path)
+    last_yield = time.monotonic()
+    partial = b""
+    while True:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = cursor
+        if size < cursor: # rotated.
+            cursor = 0
+            partial = b""
+        if size > cursor:
+            # offset is where the unfinished partial line started.
+            offset = cursor - len(partial)
+            with open(path, "rb") as f:
+                f.seek(cursor)
+                data = partial + f.read(size - cursor)
+            cursor = size
+            lines = data.split(b"\n")
+            partial = lines.pop()
+            for raw in lines:
+                offset += len(raw) + 1
+                line = _decode(raw)
+                if line_filter(line):
+                    last_yield = time.monotonic()
+                    yield offset, line
+        if time.monotonic() - last_yield >= heartbeat:
+            last_yield = time.monotonic()
+            yield cursor - len(partial), None
+        time.sleep(poll_interval)
@@ -0,0 +1,163 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+"""
+import time
+import threading
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for name, value in labels]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+class Metric:
+    """A metric with a fixed set of label names, the value of every label combination is kept separately."""
+    type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects the labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, tuple(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, value in self._samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts, _, _ = state = self._values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """observe the time taken by the body of the with statement, also when it raises."""
+        st = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - st, **labels)
+
+    def _samples(self):
+        with self._lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        samples = []
+        for key, counts, total, count in values:
+            labels = tuple(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", labels + (("le", _format_value(bound)),), cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered.")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """All the metrics in the prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    "cms_request_duration_seconds", "Time taken to handle a request, per route and status code.", ["route", "method", "status"]))
+INFERENCE_LATENCY = REGISTRY.register(Histogram(
+    "cms_inference_duration_seconds", "Time taken by one model inference, per model and prompt.", ["model", "prompt"]))
+FRAMES_INGESTED = REGISTRY.register(Counter(
+    "cms_frames_ingested_total", "Frames received for a room.", ["room"]))
+FRAMES_DROPPED = REGISTRY.register(Counter(
+    "cms_frames_dropped_total", "Frames which were never analyzed, per room and reason.", ["room", "reason"]))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "cms_queue_depth", "Number of items waiting in a queue.", ["queue", "room"]))
+FACE_MATCH_LATENCY = REGISTRY.register(Histogram(
+    "cms_face_match_duration_seconds", "Time taken to match a batch of face encodings against the face database.", ["faces"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)))
+ALERT_DB_WRITE_LATENCY = REGISTRY.register(Histogram(
+    "cms_alert_db_write_duration_seconds", "Time taken to write to the alerts database, per table.", ["table"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)))
+DETECTOR_BATCH_SIZE = REGISTRY.register(Histogram(
+    "cms_detector_batch_size", "Number of frames run through a detector in one batch.", ["model"],
+    buckets=(1, 2, 4, 8, 16, 32)))
+
+def batch_size_label(size):
+    """bucket a batch size into a label, so labels stay few."""
+    for bound in (1, 4, 16, 64):
+        if size <= bound:
+            return f"<={bound}"
+    return ">64"
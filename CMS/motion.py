@@ -0,0 +1,60 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+"""
+import os
+import cv2
+import numpy as np
+
+# fraction of the (downscaled) frame that has to change for the frame to count as "changed".
+MOTION_THRESHOLD = float(os.environ.get("CMS_MOTION_THRESHOLD", 0.01))
+# per pixel intensity difference (0-255) for a pixel to count as changed, this absorbs sensor noise.
+MOTION_PIXEL_THRESHOLD = int(os.environ.get("CMS_MOTION_PIXEL_THRESHOLD", 25))
+# width the frames are downscaled to before being compared.
+MOTION_FRAME_WIDTH = int(os.environ.get("CMS_MOTION_FRAME_WIDTH", 160))
+
+class MotionDetector:
+    """Cheap motion detection by differencing downscaled grayscale frames.
+
+    every frame is compared with the last frame that was marked as changed, not with
+    the previous frame, so slow movement still adds up to a change eventually, and
+    a frame marked static is always close to the frame the analyzers last looked at.
+    """
+    def __init__(self, threshold=MOTION_THRESHOLD, pixel_threshold=MOTION_PIXEL_THRESHOLD, frame_width=MOTION_FRAME_WIDTH):
+        self.threshold = threshold
+        self.pixel_threshold = pixel_threshold
+        self.frame_width = frame_width
+
+        self._reference = None
+
+    def _prepare(self, frame):
+        height, width = frame.shape[:2]
+        scale = min(1.0, self.frame_width / width)
+        small = cv2.resize(frame, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def changed_fraction(self, frame):
+        """fraction of the frame which differs from the reference frame, 1.0 if there is no reference."""
+        small = self._prepare(frame)
+        if (self._reference is None) or (self._reference.shape != small.shape):
+            return 1.0, small
+        diff = cv2.absdiff(small, self._reference)
+        return float(np.count_nonzero(diff > self.pixel_threshold)) / diff.size, small
+
+    def update(self, frame):
+        """Check the frame against the reference.
+
+        Returns:
+            bool: True if the frame changed, in which case it becomes the new reference.
+        """
+        fraction, small = self.changed_fraction(frame)
+        if fraction < self.threshold:
+            return False
+        self._reference = small
+        return True
+
+    def reset(self):
+        self._reference = None
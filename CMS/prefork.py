@@ -0,0 +1,135 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+
+Serve with several worker processes which share the model weights.
+
+the master process loads every model, warms up the pytorch ones, and forks CMS_WORKERS workers
+which all accept on the same socket. the torch weights are shared: tensors are moved to shared
+memory (mmapped /dev/shm files) and the python objects are frozen out of the garbage collector,
+so neither refcounts nor collections copy the pages holding the weights.
+the master runs single threaded (threads.prepare_fork), thread pools do not survive a fork.
+onnxruntime and openvino sessions are not run in the master, every worker creates its own
+sessions on its first inference, their weights are loaded per worker.
+
+state kept in memory by the server (rooms, autherized ips, the pa system, the metrics) is per worker,
+so more than one worker is for the stateless analysis endpoints, or behind a proxy which
+keeps each room and its clients on the same worker. the face database is shared through its
+file, every worker reloads the stored encodings when the file changed.
+"""
+import gc
+import os
+import signal
+import socket
+import traceback
+import numpy as np
+import torch
+from werkzeug.serving import make_server
+
+from .utils import logger
+from .threads import configure_libraries, FORK_WORKERS as WORKERS
+
+def _torch_modules(models):
+    for model in models:
+        if isinstance(model, torch.nn.Module):
+            yield model
+        elif isinstance(getattr(model, "model", None), torch.nn.Module): # ultralytics YOLO on pytorch.
+            yield model.model
+
+def share_weights(models):
+    """move the weights of the torch models to shared memory, other backends keep theirs in native memory already."""
+    for module in _torch_modules(models):
+        module.share_memory()
+
+def warm_up():
+    """Run every pytorch model once, so lazily initialized state (kernels, caches) exists before
+    the fork and is shared instead of being built by every worker.
+    models on onnxruntime or openvino are not run, a session used in the master is not usable after the fork.
+
+    Returns:
+        list: the models, for share_weights.
+    """
+    from .gradient import model as people_model, detect_people
+    from .facial_recognition import model as face_model, face_detector
+    from .facial_recognition.database import face_database
+    from .florence import florence_model, florence_endpoint
+
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    for name, model, run in (("people detector", people_model, lambda: detect_people(frame)),
+                             ("face detector", face_model, lambda: face_detector(frame)),
+                             ("face encoder", None, lambda: face_database.encode_face_crops([frame])),
+                             ("florence", florence_model, lambda: florence_endpoint(frame, ["how many people?"]))):
+        if model is not None and not any(_torch_modules([model])):
+            logger.info(f"Not warming up the {name}, it is not on pytorch.")
+            continue
+        try:
+            run()
+            logger.info(f"Warmed up the {name}.")
+        except:
+            logger.warning(f"Could not warm up the {name}: {traceback.format_exc()}")
+    return [people_model, face_model, florence_model]
+
+def _start_worker(app, sock, host, port, worker_init=None):
+    pid = os.fork()
+    if pid != 0:
+        return pid
+
+    # worker
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    try:
+        logger.info(f"Worker {os.getpid()} serving, thread budget: {configure_libraries()}")
+        if worker_init is not None:
+            worker_init()
+        make_server(host, port, app, threaded=True, fd=sock.fileno()).serve_forever()
+    except:
+        logger.error(f"Worker {os.getpid()} crashed: {traceback.format_exc()}")
+    finally:
+        os._exit(1)
+
+def serve(app, host="127.0.0.1", port=8781, workers=WORKERS, worker_init=None):
+    """Load and warm up the models, then fork workers and keep them running until SIGTERM or SIGINT.
+
+    Args:
+        worker_init (callable): called in every worker before it starts serving, e.g. to start servers of its own.
+    """
+    share_weights(warm_up())
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    # everything allocated so far is never collected, so the collector never writes to its pages.
+    gc.collect()
+    gc.freeze()
+
+    children = {_start_worker(app, sock, host, port, worker_init) for _ in range(workers)}
+    logger.info(f"Serving on {host}:{port} with {workers} workers: {sorted(children)}")
+
+    stopping = False
+    def stop(signum, _):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            logger.error(f"Worker {pid} exited with status {status}, starting a new one.")
+            children.add(_start_worker(app, sock, host, port, worker_init))
+    sock.close()
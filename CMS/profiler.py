@@ -0,0 +1,129 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+"""
+import os
+import sys
+import time
+import threading
+from collections import Counter, OrderedDict
+
+MAX_PROFILE_SECONDS = 60
+MAX_TRACES = 32
+
+class StackSampler:
+    """Statistical profiler, samples the python stack of every thread at a fixed interval.
+
+    the samples are kept in the collapsed stack format ("thread;outer;...;inner count")
+    which flamegraph.pl and speedscope read directly.
+    """
+    def __init__(self, interval=0.005, thread_ids=None):
+        """
+        Args:
+            interval (float): seconds between samples.
+            thread_ids (set[int]): only sample these threads, all threads if None.
+        """
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.samples = Counter()
+        self.sample_count = 0
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _frame_name(frame):
+        code = frame.f_code
+        return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def sample(self):
+        """take one sample of every thread, except the sampler itself."""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            self.samples[";".join(reversed(stack))] += 1
+        self.sample_count += 1
+
+    def _run(self, duration):
+        deadline = None if duration is None else time.perf_counter() + duration
+        while not self._stop.is_set():
+            self.sample()
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            self._stop.wait(self.interval)
+
+    def start(self, duration=None):
+        self._thread = threading.Thread(target=self._run, args=(duration,), name="cms-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def run(self, duration):
+        """sample for duration seconds, blocking the calling thread."""
+        self.start(duration)
+        self._thread.join()
+        return self
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common()) + "\n"
+
+# only one whole process profile may run at a time, they are not cheap.
+_profile_lock = threading.Lock()
+
+def profile_all_threads(seconds, interval=0.005):
+    """Profile every thread of the process for the given number of seconds.
+
+    Returns:
+        StackSampler: the finished sampler, or None if another profile is already running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        return StackSampler(interval).run(min(seconds, MAX_PROFILE_SECONDS))
+    finally:
+        _profile_lock.release()
+
+class RequestTracer:
+    """Samples a single thread while it handles one request, the result is kept by trace id."""
+    traces: OrderedDict = OrderedDict()
+    _lock = threading.Lock()
+
+    def __init__(self, trace_id, interval=0.001):
+        self.trace_id = trace_id
+        self.sampler = StackSampler(interval, thread_ids={threading.get_ident()})
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.sampler.stop()
+        with self._lock:
+            self.traces[self.trace_id] = {
+                "duration": time.perf_counter() - self.started,
+                "samples": self.sampler.sample_count,
+                "collapsed": self.sampler.collapsed(),
+            }
+            while len(self.traces) > MAX_TRACES:
+                self.traces.popitem(last=False)
+        return False
+
+    @classmethod
+    def get(cls, trace_id):
+        with cls._lock:
+            return cls.traces.get(trace_id)
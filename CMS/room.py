@@ -8,14 +8,32 @@ from datetime import datetime
 import threading
 import time
 import os
+import uuid
 
 if "CMS_ACTIVE" in os.environ:
     from .facial_recognition.database import face_database
-    from .gradient import model, create_gradient
+    from .gradient import people_detector, create_gradient, detect_people
+    from .facial_recognition import face_detector
     from .florence import florence_endpoint
 from .facial_recognition.track import track_faces, find_all_faces
+from .facial_recognition.identity_cache import IdentityCache
 from collections import defaultdict
-from .utils import logger, cv2image_to_base64, DetectionPrompts
+from typing import NamedTuple
+from .motion import MotionDetector
+from .heatmap_stream import HeatmapStream
+from .batching import RoomTracker
+from .density_history import DensityHistory
+from .utils import logger, rate_limited_log, DetectionPrompts
+from .metrics import FRAMES_INGESTED, FRAMES_DROPPED, QUEUE_DEPTH
+
+# how the people in a room are counted, "yolo", "florence" or "cross-check" (see Room.population).
+POPULATION_MODE = os.environ.get("CMS_POPULATION_MODE", "yolo")
+
+class PeopleSnapshot(NamedTuple):
+    """The people in a room as published by one pass of the frame detection."""
+    version: int
+    timestamp: float
+    people: tuple
 
 class Room:
     PAST_FRAMES = 24
@@ -26,12 +44,37 @@ class Room:
         self.room_name = room_name
         self.past_frames: list = []
 
-        self.people = []
+        # replaced as a whole by the detection loop, so readers never see a half built list.
+        # versions start at the creation time in milliseconds, so they keep increasing across server
+        # restarts, and a client holding a version of the last run is not told it is up to date.
+        self._people_snapshot = PeopleSnapshot(time.time_ns() // 1_000_000, time.time(), ())
+        self._people_condition = threading.Condition()
 
         self.connected_roomids = []
 
         self.is_exit = is_exit
 
+        # frames which do not differ from the last changed frame are marked static,
+        # analyzers skip static frames and reuse the result computed for the last changed frame.
+        self.motion_detector = MotionDetector()
+        self.frame_sequence = 0
+        self.last_change_sequence = 0
+        # the florence pixel cache is keyed by this and the sequence, a room created again with
+        # the same id (or one of the id-less throwaway rooms) must not get another room's frames.
+        self._cache_token = uuid.uuid4().hex
+        self._analysis_cache = {}
+
+        # identities of the faces tracked in this room, so a face is not recognized every frame.
+        self.identity_cache = IdentityCache()
+        # the face tracks of this room only, track ids are not shared with other rooms.
+        self.face_tracker = RoomTracker(face_detector) if "CMS_ACTIVE" in os.environ else None
+
+        # shared by every viewer of the live heatmap, only computes while watched.
+        self.heatmap_stream = HeatmapStream(self)
+
+        # people over time, recorded from every new person detection, without keeping frames.
+        self.density_history = DensityHistory()
+
         self._run_frame_detection = False
         self._processing_frame = False
 
@@ -49,7 +92,8 @@ class Room:
         if len(self.past_frames) == 0:
             return None
         try:
-            result = florence_endpoint(self.past_frames[-1], prompts)
+            # every prompt about the frames since the last change shares one preprocessed frame.
+            result = florence_endpoint(self.past_frames[-1], prompts, key=(self._cache_token, self.last_change_sequence))
         except:
             logger.error(f"Error: {traceback.format_exc()}")
             return None # noqa, this has the same return as if 
@@ -57,7 +101,105 @@ class Room:
         
         return result
 
+    @property
+    def people(self):
+        return self._people_snapshot.people
+
+    def people_snapshot(self):
+        return self._people_snapshot
+
+    def wait_for_people(self, since, timeout):
+        """Wait until people newer than the given version are published, returns at once if
+        since is not the current version (the caller's version is stale, or from another run).
+
+        Args:
+            since (int): the version the caller already has.
+            timeout (float): maximum number of seconds to wait.
+
+        Returns:
+            PeopleSnapshot: the newest snapshot, which may still be version since if the wait timed out.
+        """
+        with self._people_condition:
+            self._people_condition.wait_for(lambda: self._people_snapshot.version != since, timeout)
+            return self._people_snapshot
+
+    def _publish_people(self, people):
+        with self._people_condition:
+            self._people_snapshot = PeopleSnapshot(self._people_snapshot.version + 1, time.time(), tuple(people))
+            self._people_condition.notify_all()
+
+    def _cached(self, name, compute):
+        """Run an analyzer, or reuse its last result if no frame has changed since it was computed.
+
+        Args:
+            name (str): the name of the analyzer, used as the cache key.
+            compute (callable): computes the result from the current frames.
+
+        Returns:
+            the result of the analyzer, None results are never cached.
+        """
+        sequence = self.last_change_sequence
+        if name in self._analysis_cache:
+            cached_sequence, result = self._analysis_cache[name]
+            if cached_sequence == sequence:
+                rate_limited_log("DEBUG", f"Reusing {name} for room: {self._id}, no motion since frame {sequence}", key=(self._id, name))
+                return result
+
+        result = compute()
+        if result is not None:
+            self._analysis_cache[name] = (sequence, result)
+        return result
+
+    def person_points(self):
+        """Centers of the people detected in the latest frame, reused while nothing moves.
+
+        Returns:
+            list[tuple[int, int]]: the centers, None if there is no frame yet.
+        """
+        if len(self.past_frames) == 0:
+            return None
+        frame = self.past_frames[-1]
+        return self._cached("person_points", lambda: self._detect_people(frame))
+
+    def _detect_people(self, frame):
+        points = detect_people(frame)
+        # recorded once per detection, a static scene reuses the points and is not recorded again.
+        height, width = frame.shape[:2]
+        self.density_history.record(points, width, height)
+        return points
+
     def population(self):
+        """Number of people in the room.
+
+        CMS_POPULATION_MODE picks how they are counted:
+            "yolo" (default): the people detected by yolo, florence only if the detection fails.
+            "florence": ask florence, slow and sometimes answers in words instead of a number.
+            "cross-check": the yolo count, with a warning when florence disagrees.
+
+        Returns:
+            int: number of people in the room, None if there is no frame or no count could be made.
+        """
+        if POPULATION_MODE == "florence":
+            return self._florence_population()
+
+        try:
+            points = self.person_points()
+        except:
+            logger.error(f"Error while detecting the people of room {self._id}, falling back to florence: {traceback.format_exc()}")
+            return self._florence_population()
+        if points is None:
+            return None
+
+        if POPULATION_MODE == "cross-check":
+            florence_count = self._florence_population()
+            if (florence_count is not None) and (florence_count != len(points)):
+                rate_limited_log("WARNING", f"Population of room {self._id}: yolo counted {len(points)}, florence counted {florence_count}", key=(self._id, "cross-check"))
+        return len(points)
+
+    def _florence_population(self):
+        return self._cached("florence_population", self._population)
+
+    def _population(self):
         try:
             return int(self._florence_endpoint(["how many people?"])[0])
         except:
@@ -65,22 +207,30 @@ class Room:
             return None
     
     def density(self):
-        return self.population()/self.room_capacity
-    
+        population = self.population()
+        return None if population is None else population/self.room_capacity
+
+    def average_density(self, window):
+        """average density over the last window seconds, None if nothing was recorded."""
+        occupancy = self.density_history.average_occupancy(window)
+        return None if occupancy is None else occupancy/self.room_capacity
+
     def vector_map(self):
+        return self._cached("vector_map", self._vector_map)
+
+    def _vector_map(self):
         track_history = defaultdict(lambda: [])
         
-        frame = None
-        for i in range(min([self.PAST_FRAMES, len(self.past_frames)])):
+        frames = self.past_frames[-self.PAST_FRAMES:]
+        # detect the people of every past frame in one batch, then track through them in order.
+        tracker = RoomTracker(people_detector, tracker="bytetrack.yaml")
+        detections = people_detector.predict_many(frames, conf=0.1, classes=[0])  # 0 = person class
+        for frame, result in zip(frames, detections):
+            result = tracker.update(frame, result)
 
-            frame = self.past_frames[i]
-
-            # Run YOLO tracking
-            results = model.track(frame, persist=True, tracker="bytetrack.yaml", classes=[0])  # 0 = person class
-
-            if results[0].boxes.id is not None:
-                boxes = results[0].boxes.xywh.cpu()
-                track_ids = results[0].boxes.id.int().cpu().tolist()
+            if result.boxes.id is not None:
+                boxes = result.boxes.xywh.cpu()
+                track_ids = result.boxes.id.int().cpu().tolist()
 
                 for box, track_id in zip(boxes, track_ids):
                     x, y, w, h = box
@@ -93,7 +243,7 @@ class Room:
                         track.pop(0)
 
 
-        logger.debug(f"Calculated Track History: {track_history}, for room: {self.__repr__()}")
+        logger.opt(lazy=True).debug("Calculated Track History: {}, for room: {}", lambda: dict(track_history), self.__repr__)
         return dict(track_history)
 
     def clean_old_data(self):
@@ -102,12 +252,13 @@ class Room:
     def _check_for_autherization(self, tol=0.6):
         unautherized_faces = []
         frame = self.past_frames[-1]
-        for face in find_all_faces(frame):
-            encoding = face["encoding"]
-            if encoding == None:
+        faces = find_all_faces(frame)
+        records = iter(face_database.find_matches([face["encoding"] for face in faces if face["encoding"] is not None], tol))
+        for face in faces:
+            if face["encoding"] is None:
                 unautherized_faces.append({"autherized": False, "state": 0, "reason": "Unclear", "detection": face["yolo_result"]})
                 continue
-            record = face_database.find_match(encoding, tol)
+            record = next(records)
 
             # if a record was not found or if the access was not autherized.
             if (record == None) or ((not record["admin"]) and (not self._id in record["rooms_access"])):
@@ -125,7 +276,17 @@ class Room:
         self.past_frames.append(frame)
         self.clean_old_data()
 
-        self._run_frame_detection = True
+        self.frame_sequence += 1
+        FRAMES_INGESTED.inc(room=self._id)
+        QUEUE_DEPTH.set(len(self.past_frames), queue="past_frames", room=self._id)
+        if self.motion_detector.update(frame):
+            if self._run_frame_detection:
+                # the previous changed frame was never picked up by the detection loop.
+                FRAMES_DROPPED.inc(room=self._id, reason="superseded")
+            self.last_change_sequence = self.frame_sequence
+            self._run_frame_detection = True
+        else:
+            FRAMES_DROPPED.inc(room=self._id, reason="static")
 
     def run_frame_detection(self):
         """
@@ -145,49 +306,68 @@ class Room:
 
             if not self.alive:
                 return
-            logger.info(f"Starting Processing of room: {self.__repr__()}")
+            rate_limited_log("INFO", f"Starting Processing of room: {self._id}", key=(self._id, "start"))
 
-            frame = self.past_frames[-1]
-            
             self._processing_frame = True
+            try:
+                self._process_frame(self.past_frames[-1])
+            except:
+                # a detector timeout or model error must not end the detection of the room.
+                logger.error(f"Error while processing a frame of room {self._id}: {traceback.format_exc()}")
+            finally:
+                self._processing_frame = False
+                self._run_frame_detection = False
 
-            self.people = []
-
-            track_res = track_faces(frame)
-            
-            for box in track_res.boxes.xyxy.cpu().numpy():
-                
-                x1, y1, x2, y2 = box
-
-                face_location = (y1, x2, y2, x1)
-                
-                face_encodings = face_database._encode_face(frame, [face_location])
-                
-                if isinstance(face_encodings,type(None)):
-                    logger.warning("Face Not detected by facial recognition, but detected by yolo.")
-                    continue
-                    
-                current_encoding = face_encodings[0]
-                
-                current_person = face_database.find_match(current_encoding)
-                if current_person == None:
-                    current_person = {
-                        'unique_key': "unautherized",
-                        'image': frame,
-                        'timestamp': datetime.now().strftime("%Y-%m-%d_%H-%M-%S"),
-                        "name": "unautherized",
-                        "desc": "unautherized",
-                        "encoding": current_encoding,
-                    }
-                
-                self.people.append(current_person)
-            
-            self._processing_frame = False
-            self._run_frame_detection = False
-
-            logger.info(f"Finished Processing of room: {self.__repr__()}")
+            rate_limited_log("INFO", f"Finished Processing of room: {self._id}", key=(self._id, "finish"))
+
+    def _process_frame(self, frame):
+        """track and recognize the faces of one changed frame, and publish the people found."""
+        people = []
+
+        track_res = track_faces(frame, self.face_tracker)
+
+        face_locations = [(y1, x2, y2, x1) for x1, y1, x2, y2 in track_res.boxes.xyxy.cpu().numpy()]
+        track_ids = track_res.boxes.id.int().cpu().tolist() if track_res.boxes.id is not None else [None] * len(face_locations)
+
+        # only recognize the faces whose tracks are new, uncertain or old.
+        now = time.time()
+        to_recognize = [i for i, track_id in enumerate(track_ids) if self.identity_cache.needs_recognition(track_id, now)]
+
+        # encode and match every face that needs recognition in one batch.
+        face_encodings = face_database.encode_faces(frame, [face_locations[i] for i in to_recognize])
+        matches, distances = face_database.find_matches(face_encodings, return_distances=True)
+
+        recognized = {}
+        for i, current_encoding, current_person, distance in zip(to_recognize, face_encodings, matches, distances):
+            if current_person == None:
+                current_person = {
+                    'unique_key': "unautherized",
+                    'image': frame,
+                    'timestamp': datetime.now().strftime("%Y-%m-%d_%H-%M-%S"),
+                    "name": "unautherized",
+                    "desc": "unautherized",
+                    "encoding": current_encoding,
+                }
+            recognized[i] = current_person
+            if track_ids[i] is not None:
+                self.identity_cache.update(track_ids[i], current_person, IdentityCache.confidence(distance), now)
+
+        for i, track_id in enumerate(track_ids):
+            people.append(recognized[i] if i in recognized else self.identity_cache.get(track_id, now))
+        self.identity_cache.prune(now)
+
+        self._publish_people(people)
+
+        rate_limited_log("DEBUG", f"Recognized {len(to_recognize)} of {len(track_ids)} faces in room: {self._id}", key=(self._id, "recognized"))
+
+        # the people of every changed frame go into the density history. the detection is cached
+        # for the frame, so population, the gradient and the heatmap of this frame reuse it.
+        self.person_points()
     
     def danger_checks(self):
+        return self._cached("danger_checks", self._danger_checks)
+
+    def _danger_checks(self):
         prompts = [DetectionPrompts.FIRE,
                    DetectionPrompts.STAMPEED,
                    DetectionPrompts.FALL,
@@ -196,17 +376,20 @@ class Room:
                    DetectionPrompts.DANGER,
                    ]
         res = self._florence_endpoint(prompts)
+        if res is None:
+            return None
         res = {prompts[i]: res[i] for i in range(len(res))}
         logger.debug(f"Result of checking danger: {res}")
         return res
 
     def _create_gradient(self, kernel_size, scale_factor):
-        return cv2image_to_base64(create_gradient(self.past_frames[-1], kernel_size=kernel_size, scale_factor=scale_factor))
+        return create_gradient(self.past_frames[-1], _kernel_size=kernel_size, scale_factor=scale_factor, points=self.person_points())
     
     def remove(self):
         while self._processing_frame:
             time.sleep(1)
         self.alive = False
+        self.heatmap_stream.stop()
 
     def __repr__(self):
         return self.__str__()
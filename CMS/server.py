@@ -11,15 +11,19 @@ import logging
 import traceback
 from functools import wraps
 import base64
-from googletrans import Translator
+import uuid
+import json
+from datetime import datetime
 
 from .utils import (
     logger_file, 
     logger, 
     get_image_file, 
     get_images_file, 
-    cv2image_to_base64, 
-    recognize_from_wav_bytes,
+    encode_image,
+    IMAGE_FORMATS,
+    rate_limited_log,
+    LOG_LEVEL,
     DetectionPrompts)
 from .florence import florence_endpoint
 if "CMS_ACTIVE" in os.environ:
@@ -27,34 +31,69 @@ if "CMS_ACTIVE" in os.environ:
 from .room import Room
 from .graph_solver import rooms_to_nodes, get_optimal_path, Node
 if "CMS_ACTIVE" in os.environ:
-    from .tts import generate_tts
+    from .tts import tts_cache
+    from .translater.translation import translation_service
     from .facial_recognition.database import face_database
-from .gradient import create_gradient
+from .gradient import create_gradient, render_density
+from .tts import AUDIO_FORMATS
+from .translater.speech import transcribe_wav
+from .async_streams import AsyncStreamServer, AudioSession, AudioStreamSession, TranslateSession
+from .metrics import REGISTRY, REQUEST_LATENCY, FRAMES_DROPPED
+from .logs import tail_lines, read_page, follow
+from .profiler import profile_all_threads, RequestTracer, MAX_PROFILE_SECONDS
+from .threads import configure_libraries, thread_report
+from .prefork import serve as serve_prefork, WORKERS
+
+if WORKERS == 1:
+    # with prefork the master stays single threaded, every worker sets its budget after the fork.
+    logger.info(f"Thread budget: {configure_libraries()}")
 
 app = flask.Flask(__name__)
 
 websocket_app = WebSockets(app)
-translator = Translator()
 
 PA_SYSTEM_AUTHERIZED = False
 ADMIN_IP = "127.0.0.1" if "CMS_LOCAL_ADMIN" in os.environ else None
 AUTHERIZED_IPS = ["127.0.0.1"] # localhost is already autherized.
+MAX_PEOPLE_POLL_TIMEOUT = 30
+MAX_LOG_LINES = 10000
+# format of the PA audio when the PA system does not ask for one, "mp3" or "wav".
+PA_AUDIO_FORMAT = os.environ.get("CMS_PA_AUDIO_FORMAT", "mp3")
 
 ROOMS: dict[str, Room] = {}
 
 #region setup logging
+def _status_code(result):
+    """the status code of whatever a view returned."""
+    if isinstance(result, tuple) and len(result) > 1 and isinstance(result[1], int):
+        return result[1]
+    return getattr(result, "status_code", 200)
+
 def safe_runner(url, *, router=app.route, **flask_kwargs):
     def decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            logger.info(f"Calling the Endpoint: {url}")
-            logger.debug(f"Calling: {f.__qualname__}")
+            rate_limited_log("INFO", f"Calling the Endpoint: {url}, {f.__qualname__}", key=url)
+            st = time.perf_counter()
+            status = 500
             try:
-                return f(*args, **kwargs)
+                # one-shot tracing of this request, only for the admin.
+                if flask.has_request_context() and flask.request.headers.get("X-CMS-Trace") and flask.request.remote_addr == ADMIN_IP:
+                    trace_id = uuid.uuid4().hex
+                    with RequestTracer(trace_id):
+                        result = flask.make_response(f(*args, **kwargs))
+                    result.headers["X-CMS-Trace-Id"] = trace_id
+                    logger.info(f"Traced request: {url}, trace id: {trace_id}")
+                else:
+                    result = f(*args, **kwargs)
+                status = _status_code(result)
+                return result
             except:
                 error_string = traceback.format_exc()
                 logger.error(f"During request: {f.__qualname__}, There was an error: \n{error_string}")
                 return flask.jsonify({"error": error_string}), 500
+            finally:
+                REQUEST_LATENCY.observe(time.perf_counter() - st, route=url, method=flask.request.method if flask.has_request_context() else "WEBSOCKET", status=status)
         return router(url, **flask_kwargs)(wrapper)
     return decorator
 
@@ -69,20 +108,60 @@ def intercept_flask_logging():
                 level = logger.level(record.levelname).name
             except ValueError:
                 level = record.levelno
-            frame, depth = logging.currentframe(), 2
-            while frame.f_code.co_filename == logging.__file__:
-                frame = frame.f_back
-                depth += 1
-                
-            logger.opt(depth=depth, exception=record.exc_info).log(
+            # emit is always reached through the same logging calls, so the caller
+            # is a fixed depth away, no need to walk the stack for every record.
+            logger.opt(depth=6, exception=record.exc_info).log(
                 level, record.getMessage()
             )
     
     # flask_logger.addHandler(InterceptHandler())
     
-    logging.basicConfig(handlers=[InterceptHandler()], level=0)
+    # records below the level loguru writes are never created, instead of being created and dropped.
+    logging.basicConfig(handlers=[InterceptHandler()], level=logger.level(LOG_LEVEL).no)
 intercept_flask_logging()
 
+#endregion
+#region image responses
+IMAGE_MIMETYPES = {mimetype: name for name, (_, mimetype) in IMAGE_FORMATS.items()}
+
+def image_response(image, key="image", allow_raw=True, **extra):
+    """Respond with an image, encoded as the client asked for in the query arguments.
+
+    optional query argument "format", one of png, jpeg, webp (CMS_IMAGE_FORMAT by default).
+    optional query argument "quality", 0-100 for jpeg and webp.
+    optional query argument "max_dim", downscale the image so neither side is larger.
+    optional query argument "raw", respond with the encoded image itself instead of base64 in json,
+    also done if the Accept header asks for an image format.
+
+    Args:
+        image (numpy.ndarray): the cv2 image.
+        key (str): the json key of the base64 image, if None the json is just the base64 string.
+        allow_raw (bool): False if the response has to carry other json (extra).
+
+    Returns:
+        flask.Response: the image.
+    """
+    fmt = flask.request.args.get("format")
+    raw = flask.request.args.get("raw", "").lower() in ("1", "true", "yes")
+    if fmt is not None and not fmt.lower() in IMAGE_FORMATS:
+        return flask.jsonify({"error": f"Unknown image format: {fmt}, must be one of {list(IMAGE_FORMATS)}"}), 400
+    if allow_raw and fmt is None:
+        # a client which explicitly accepts an image format, and prefers it over json, gets the image itself.
+        accepted = [mimetype for mimetype, quality in flask.request.accept_mimetypes if mimetype in IMAGE_MIMETYPES and quality > 0]
+        if accepted:
+            best = flask.request.accept_mimetypes.best_match(accepted + ["application/json"])
+            if best in IMAGE_MIMETYPES:
+                fmt, raw = IMAGE_MIMETYPES[best], True
+
+    data, mimetype = encode_image(image, fmt, flask.request.args.get("quality", type=int), flask.request.args.get("max_dim", type=int))
+    if allow_raw and raw:
+        return flask.Response(data, mimetype=mimetype), 200
+
+    encoded = base64.b64encode(data).decode()
+    if key is None:
+        return flask.jsonify(encoded), 200
+    return flask.jsonify({key: encoded, "mimetype": mimetype, **extra}), 200
+
 #endregion
 #region setup error handing
 @app.errorhandler(404)
@@ -94,9 +173,86 @@ def http_error_handler(_):
     return flask.jsonify({"error": "Unautherized."}), 405
 #endregion
 
+@app.route("/metrics")
+def metrics():
+    """Metrics in the prometheus text format, not wrapped in safe_runner
+    so that scraping does not show up in the request metrics.
+    with CMS_WORKERS > 1 every worker keeps its own metrics, this returns those of
+    the worker which took the request.
+    """
+    return flask.Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+#region Logs
 @safe_runner("/")
 def get_logs():
-    return open(logger_file, "r").read(), 200
+    """The last lines of the log file, as plain text.
+
+    optional query arguments "lines" (default 1000), "level" (minimum level) and "contains" (substring).
+    """
+    lines, _ = tail_lines(logger_file,
+                          min(flask.request.args.get("lines", 1000, type=int), MAX_LOG_LINES),
+                          flask.request.args.get("level"),
+                          flask.request.args.get("contains"))
+    return flask.Response("\n".join(lines), mimetype="text/plain"), 200
+
+@safe_runner("/logs/tail")
+def logs_tail():
+    """The last lines of the log file.
+
+    optional query arguments "lines" (default 1000), "level" (minimum level) and "contains" (substring).
+
+    Returns:
+        flask.Response: "lines", and "cursor" from which /logs/page or /logs/stream can continue.
+    """
+    lines, cursor = tail_lines(logger_file,
+                               min(flask.request.args.get("lines", 1000, type=int), MAX_LOG_LINES),
+                               flask.request.args.get("level"),
+                               flask.request.args.get("contains"))
+    return flask.jsonify({"lines": lines, "cursor": cursor}), 200
+
+@safe_runner("/logs/page")
+def logs_page():
+    """Page through the log file from a cursor (a byte offset, 0 for the start of the file).
+
+    optional query arguments "cursor", "limit" (default 500 lines), "level" (minimum level) and "contains" (substring).
+
+    Returns:
+        flask.Response: "lines", "next_cursor" for the next page and "eof".
+    """
+    lines, cursor, eof = read_page(logger_file,
+                                   max(flask.request.args.get("cursor", 0, type=int), 0),
+                                   min(flask.request.args.get("limit", 500, type=int), MAX_LOG_LINES),
+                                   flask.request.args.get("level"),
+                                   flask.request.args.get("contains"))
+    return flask.jsonify({"lines": lines, "next_cursor": cursor, "eof": eof}), 200
+
+@safe_runner("/logs/raw")
+def logs_raw():
+    """The raw log file, streamed from disk, supports Range requests for byte ranges."""
+    return flask.send_file(logger_file, mimetype="text/plain", conditional=True, max_age=0)
+
+@safe_runner("/logs/stream")
+def logs_stream():
+    """Follow the log file as server sent events, every event id is a cursor, so a
+    reconnecting EventSource continues where it stopped (Last-Event-ID).
+
+    optional query arguments "cursor" (default the end of the file), "level" (minimum level) and "contains" (substring).
+    """
+    cursor = flask.request.headers.get("Last-Event-ID", type=int)
+    if cursor is None:
+        cursor = flask.request.args.get("cursor", type=int)
+    level = flask.request.args.get("level")
+    contains = flask.request.args.get("contains")
+
+    def events():
+        for event_cursor, line in follow(logger_file, cursor, level, contains):
+            if line is None:
+                yield ": heartbeat\n\n"
+            else:
+                yield f"id: {event_cursor}\ndata: {line}\n\n"
+
+    return flask.Response(flask.stream_with_context(events()), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"}), 200
+#endregion
 
 #region Analyze
 @safe_runner("/analyze", methods=["POST"])
@@ -113,7 +269,7 @@ def analyze():
         with the given image
     """
     logger.info("Analyzing...")
-    logger.debug(f"{flask.request.json['prompts']}")
+    logger.opt(lazy=True).debug("{}", lambda: flask.request.json['prompts'])
     results = florence_endpoint(get_image_file(), flask.request.json['prompts'])
     return flask.jsonify({"results": results}), 200
 
@@ -277,36 +433,138 @@ def to_autherize_alerts():
 
 @safe_runner("/alerts/autherize-urgent", methods=["POST"])
 def autherize_alerts():
-    alerts_database.autherize(int(flask.request.json["alert_id"])) # autherize the urgent alert.
+    """autherize an urgent alert, its PA announcement starts rendering right away.
+
+    requred post argument "alert_id", optional "signatory", the remote address by default.
+    """
+    alert = alerts_database.autherize(int(flask.request.json["alert_id"]), flask.request.json.get("signatory", flask.request.remote_addr)) # autherize the urgent alert.
+    if alert is not None:
+        # so the PA system can play it as soon as it asks.
+        tts_cache.prerender(*_announcement(alert), fmt=PA_AUDIO_FORMAT)
     return flask.jsonify({"success": True}), 200
 #endregion
 #endregion
 #region PA-system
-@safe_runner("/pa-system")
-def pa_system():
+def _announcement(alert):
+    """the text of the PA announcement of an urgent alert.
+
+    Returns:
+        tuple[str, int]: the text, and how many times it is repeated.
+    """
+    room = ROOMS.get(alert["room_id"]) if alert["room_id"] != None else None
+    if room is None:
+        return f"WARNING WARNING, {alert["message"]}", 1
+    return f"WARNING WARNING, {alert["message"]}, In Room {room.room_name}, this is not a drill, I repeat", 5
+
+def _pa_alert():
+    """the urgent alert the PA system should announce, with its escape route.
+
+    Returns:
+        tuple[dict, None] | tuple[None, response]: the alert, or the response to give instead.
+    """
     if not PA_SYSTEM_AUTHERIZED:
-        return flask.jsonify({"message": "The PA System is not currently announcing. If required ask admin to autherize."}), 405
+        return None, (flask.jsonify({"message": "The PA System is not currently announcing. If required ask admin to autherize."}), 405)
     res: dict = alerts_database._get_newest_alert("urgent")
+    if res is None:
+        return None, (flask.jsonify({"message": "There is no autherized urgent alert to announce."}), 404)
     if res["room_id"] != None:
         room_id = res["room_id"]
-        room = ROOMS[room_id]
         logger.info(f"Getting Escape route from room_id: {room_id}")
         nodes = rooms_to_nodes(ROOMS)
-        logger.debug(f"Nodes: {nodes}")
+        logger.opt(lazy=True).debug("Nodes: {}", lambda: nodes)
         path: list[Node] = get_optimal_path(nodes[room_id], [nodes[room_id] for room_id in nodes if nodes[room_id].is_outer])
-        logger.debug(f"Path: {path}")
+        logger.opt(lazy=True).debug("Path: {}", lambda: path)
 
         # we are not considering what happens when we can't find an escape route in such a situation.
         # because the crowd doesn't need to know that, it would only make a already panaking situation
         # much much worse.
         if path != None:
             res["escape-path"] = {"path": " ->".join([node.name for node in path[0]])}
-        tts_res = generate_tts(" ".join([f"WARNING WARNING, {res["message"]}, In Room {room.room_name}, this is not a drill, I repeat"]*5))
-    else:
-        tts_res = generate_tts(f"WARNING WARNING, {res["message"]}")
-    
-    res["mp3"] = tts_res["mp3"]
-    res["wav"] = tts_res["wav"]
+    return res, None
+
+def _audio_format():
+    """the audio format asked for, the "format" query argument, or else the Accept header.
+
+    Returns:
+        str | None: "mp3" or "wav", None if the format asked for is not supported.
+    """
+    if "format" in flask.request.args:
+        fmt = flask.request.args["format"].lower()
+        return fmt if fmt in AUDIO_FORMATS else None
+    if not flask.request.accept_mimetypes or flask.request.accept_mimetypes.best == "*/*":
+        return PA_AUDIO_FORMAT
+    mimetype = flask.request.accept_mimetypes.best_match([AUDIO_FORMATS[PA_AUDIO_FORMAT]] + list(AUDIO_FORMATS.values()))
+    return {value: key for key, value in AUDIO_FORMATS.items()}.get(mimetype)
+
+def _send_audio(path, fmt):
+    # streamed from disk in chunks, with Range and conditional requests, so playback can start right away.
+    response = flask.send_file(path, mimetype=AUDIO_FORMATS[fmt], conditional=True, etag=True, max_age=3600)
+    response.headers["Accept-Ranges"] = "bytes"
+    return response
+
+@safe_runner("/pa-system/announcement")
+def pa_announcement():
+    """the current PA announcement, without audio.
+
+    Returns:
+        the alert, with "audio": the url of the audio in the default format, and "formats": the url per format.
+        the urls are content addressed, they never change for the same announcement.
+    """
+    res, error = _pa_alert()
+    if error is not None:
+        return error
+    text, repeat = _announcement(res)
+    key = tts_cache.key(text, repeat)
+    # most likely rendered already when the alert was autherized.
+    tts_cache.prerender(text, repeat, fmt=PA_AUDIO_FORMAT)
+    res["audio_key"] = key
+    res["formats"] = {fmt: flask.url_for("pa_audio_by_key", key=key, fmt=fmt) for fmt in AUDIO_FORMATS}
+    res["audio"] = res["formats"][PA_AUDIO_FORMAT]
+    return flask.jsonify(res), 200
+
+@safe_runner("/pa-system/audio")
+def pa_audio():
+    """the audio of the current PA announcement, in one format (see _audio_format), as a binary stream."""
+    res, error = _pa_alert()
+    if error is not None:
+        return error
+    fmt = _audio_format()
+    if fmt is None:
+        return flask.jsonify({"message": f"Unsupported audio format, supported: {list(AUDIO_FORMATS)}"}), 406
+    response = _send_audio(tts_cache.file(*_announcement(res), fmt=fmt), fmt)
+    # the current announcement changes, the keyed url does not.
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["Vary"] = "Accept"
+    return response
+
+@safe_runner("/pa-system/audio/<key>.<fmt>")
+def pa_audio_by_key(key, fmt):
+    """the audio of an announcement by its key (from /pa-system/announcement), as a binary stream."""
+    if not PA_SYSTEM_AUTHERIZED:
+        return flask.jsonify({"message": "The PA System is not currently announcing. If required ask admin to autherize."}), 405
+    if not fmt in AUDIO_FORMATS:
+        return flask.jsonify({"message": f"Unsupported audio format, supported: {list(AUDIO_FORMATS)}"}), 404
+    if len(key) != 64 or any(c not in "0123456789abcdef" for c in key):
+        return flask.jsonify({"message": "Unknown announcement."}), 404
+    path = tts_cache.file_by_key(key, fmt)
+    if path is None:
+        return flask.jsonify({"message": "Unknown announcement."}), 404
+    return _send_audio(path, fmt)
+
+@safe_runner("/pa-system")
+def pa_system():
+    """the current PA announcement with its audio as base64, both mp3 and wav.
+
+    kept for older PA clients, /pa-system/announcement and /pa-system/audio send a fraction of the bytes.
+    """
+    res, error = _pa_alert()
+    if error is not None:
+        return error
+
+    # rendered when the alert was autherized, or by the first request asking for it.
+    tts_res = tts_cache.get(*_announcement(res))
+    res["mp3"] = base64.b64encode(tts_res["mp3"]).decode()
+    res["wav"] = base64.b64encode(tts_res["wav"]).decode()
         
     return flask.jsonify(res), 200
 #endregion
@@ -328,6 +586,58 @@ def register_admin():
         return "", 405
     return "", 200
 
+@safe_runner("/admin/profile")
+def profile_server():
+    """Profile every thread of the server (room detection, websockets, requests) with
+    a statistical sampler, admin only.
+
+    optional query argument "seconds", how long to sample for, at most MAX_PROFILE_SECONDS.
+    optional query argument "interval", milliseconds between samples.
+
+    Returns:
+        flask.Response: collapsed stacks, as read by flamegraph.pl or speedscope. 409 if a profile is already running.
+    """
+    if flask.request.remote_addr != ADMIN_IP:
+        return "", 405
+    seconds = min(flask.request.args.get("seconds", 10, type=float), MAX_PROFILE_SECONDS)
+    interval = max(flask.request.args.get("interval", 5, type=float), 1) / 1000
+
+    logger.warning(f"Profiling the server for {seconds} seconds.")
+    sampler = profile_all_threads(seconds, interval)
+    if sampler is None:
+        return flask.jsonify({"error": "A profile is already running."}), 409
+    return flask.Response(sampler.collapsed(), mimetype="text/plain"), 200
+
+@safe_runner("/admin/threads")
+def get_thread_budget():
+    """The effective thread counts of torch, onnxruntime, opencv and the BLAS, admin only.
+
+    Returns:
+        flask.Response: 200, the thread budget.
+    """
+    if flask.request.remote_addr != ADMIN_IP:
+        return "", 405
+    return flask.jsonify(thread_report()), 200
+
+@safe_runner("/admin/trace/<trace_id>")
+def get_trace(trace_id):
+    """Get the profile of a request which was sent with the "X-CMS-Trace" header, admin only.
+
+    Args:
+        trace_id (str): the "X-CMS-Trace-Id" header of the traced response.
+
+    Returns:
+        flask.Response: collapsed stacks of the request thread.
+    """
+    if flask.request.remote_addr != ADMIN_IP:
+        return "", 405
+    trace = RequestTracer.get(trace_id)
+    if trace is None:
+        return flask.jsonify({"error": "No such trace."}), 404
+    return flask.Response(trace["collapsed"], mimetype="text/plain", headers={
+        "X-CMS-Trace-Duration": str(trace["duration"]),
+        "X-CMS-Trace-Samples": str(trace["samples"])}), 200
+
 @safe_runner("/autherize", methods=["POST"])
 def autherize_ips():
     """add an autherized ip address
@@ -376,9 +686,9 @@ def get_all_escape_routes():
     for room_id in ROOMS.keys():
         logger.info(f"Getting Escape route from room_id: {room_id}")
         nodes = rooms_to_nodes(ROOMS)
-        logger.debug(f"Nodes: {nodes}")
+        logger.opt(lazy=True).debug("Nodes: {}", lambda: nodes)
         path: list[Node] = get_optimal_path(nodes[room_id], [nodes[room_id] for room_id in nodes if nodes[room_id].is_outer])
-        logger.debug(f"Path: {path}")
+        logger.opt(lazy=True).debug("Path: {}", lambda: path)
         if path == None:
             rooms_to_escape[ROOMS[room_id].room_name] = []
         else:
@@ -412,7 +722,7 @@ def create_room(room_id):
     if room_id in ROOMS:
         logger.warning("Room Already Exists."), 203
     ROOMS[room_id] = Room(room_id, flask.request.json["name"], int(flask.request.json["capacity"]), flask.request.json["exit"])
-    logger.debug(ROOMS)
+    logger.opt(lazy=True).debug("Rooms: {}", lambda: ROOMS)
     return "", 200
 
 @safe_runner("/room/get-exit-rooms")
@@ -448,10 +758,16 @@ def room_stream(ws: WebSocket, room_id: str):
         logger.warning("The websocket is being closed, since the room_id requested does not exist.")
         return "", 404
     while True:
+        # a closed or broken connection ends the handler, only a frame which cannot be decoded is skipped.
+        message = ws.receive()
+        if message is None:
+            return
         try:
-            recieved_data = get_image_file(ws.receive())
-        except:
-            logger.error(f"Error Recieving Data: {traceback.format_exc()}")
+            recieved_data = get_image_file(message)
+        except Exception:
+            logger.error(f"Error Decoding a frame of room {room_id}: {traceback.format_exc()}")
+            FRAMES_DROPPED.inc(room=room_id, reason="decode_error")
+            continue
         ROOMS[room_id].append_frame(recieved_data)
 
 @safe_runner("/room/add-connection", methods=["POST"])
@@ -468,7 +784,7 @@ def add_connection():
     """
     room = ROOMS[flask.request.json["room_id"]]
     logger.info(f"Adding connection between {flask.request.json["room_id"]} and {flask.request.json["connected_rooms"]}")
-    logger.debug(f"{room}")
+    logger.opt(lazy=True).debug("{}", lambda: room)
     for room_id in flask.request.json["connected_rooms"]:
         room.connect_room(room_id)
     return "", 200
@@ -556,9 +872,9 @@ def escape_route(room_id):
     """
     logger.info(f"Getting Escape route from room_id: {room_id}")
     nodes = rooms_to_nodes(ROOMS)
-    logger.debug(f"Nodes: {nodes}")
+    logger.opt(lazy=True).debug("Nodes: {}", lambda: nodes)
     path: list[Node] = get_optimal_path(nodes[room_id], [nodes[room_id] for room_id in nodes if nodes[room_id].is_outer])
-    logger.debug(f"Path: {path}")
+    logger.opt(lazy=True).debug("Path: {}", lambda: path)
     if path == None:
         return flask.jsonify({"error": "No Path found...."}), 204
     return flask.jsonify({"path": " ->".join([node.name for node in path[0]])}), 200
@@ -578,24 +894,38 @@ def is_autherized(room_id):
 
     autherization, frame = room._check_for_autherization()
 
-    return flask.jsonify({"people": autherization, "image": cv2image_to_base64(frame)}), 200
+    return image_response(frame, allow_raw=False, people=autherization)
 
 @safe_runner("/room/get-people/<room_id>")
 def get_people(room_id):
     """Get the description of every autherized person in the room as per
     database.
 
+    optional query argument "since", the version of people the client already has,
+    if it is still the current version 304 is returned.
+    optional query argument "timeout", seconds to wait for people newer than "since"
+    before returning (long-poll), at most MAX_PEOPLE_POLL_TIMEOUT.
+
     Args:
         room_id (str): the id of the room.
 
     Returns:
-        flask.Response: detailes of every autherized person in the room.
+        flask.Response: detailes of every autherized person in the room, with the version and timestamp
+        of the detection pass that found them.
     """
     room = ROOMS[room_id]
-    
-    while room._processing_frame:
-        logger.warning("ASked for number people, room is getting processed, this will take some time...")
-        time.sleep(1)
+
+    since = flask.request.args.get("since", type=int)
+    timeout = min(flask.request.args.get("timeout", 0, type=float), MAX_PEOPLE_POLL_TIMEOUT)
+
+    if (since is not None) and (timeout > 0):
+        snapshot = room.wait_for_people(since, timeout)
+    else:
+        snapshot = room.people_snapshot()
+
+    # any other version than the current one is stale, also one greater than it (from before a restart).
+    if (since is not None) and (snapshot.version == since):
+        return "", 304
     
     result = [{
             'unique_key': person['unique_key'],
@@ -603,8 +933,8 @@ def get_people(room_id):
             'timestamp': person['timestamp'],
             "name": person["name"],
             "desc": person["desc"],
-        } for person in room.people]
-    return flask.jsonify({"people":result}), 200
+        } for person in snapshot.people]
+    return flask.jsonify({"people":result, "version": snapshot.version, "timestamp": snapshot.timestamp}), 200
 
 @safe_runner("/room/check-danger/<room_id>")
 def check_danger_room(room_id):
@@ -630,7 +960,107 @@ def room_create_gradient(room_id):
         flask.Response: either Null or the image.
     """
     room = ROOMS[room_id]
-    return flask.jsonify(room._create_gradient(flask.request.json["kernel_size"], flask.request.json["scale_factor"])), 200
+    params = flask.request.get_json(silent=True) or flask.request.args
+    return image_response(room._create_gradient(int(params.get("kernel_size", 500)), float(params.get("scale_factor", 0.01))), key=None)
+
+@safe_runner("/room/heatmap-stream/<room_id>")
+def room_heatmap_stream(room_id):
+    """A live heatmap of the room as an MJPEG stream (multipart/x-mixed-replace),
+    can be opened directly by browsers and most video players.
+
+    Args:
+        room_id (str): The ID of the room
+
+    Returns:
+        flask.Response: the stream.
+    """
+    stream = ROOMS[room_id].heatmap_stream
+
+    def parts():
+        for frame in stream.frames():
+            yield b"--frame\r\nContent-Type: " + stream.mimetype.encode() + b"\r\nContent-Length: " + str(len(frame)).encode() + b"\r\n\r\n" + frame + b"\r\n"
+
+    return flask.Response(parts(), mimetype="multipart/x-mixed-replace; boundary=frame"), 200
+
+@safe_runner("/room/heatmap/<room_id>", router=websocket_app.route)
+def room_heatmap_websocket(ws: WebSocket, room_id: str):
+    """A live heatmap of the room, every message is one encoded heatmap frame.
+
+    Args:
+        ws (WebSocket): the websocket connection.
+        room_id (str): the id of the room.
+    """
+    if not room_id in ROOMS:
+        logger.warning("The websocket is being closed, since the room_id requested does not exist.")
+        return "", 404
+    for frame in ROOMS[room_id].heatmap_stream.frames():
+        ws.send(frame)
+
+def _history_since():
+    """the "since" query argument as a timestamp, "today" is local midnight.
+
+    Returns:
+        float: the timestamp, None if it is neither a number nor "today".
+    """
+    since = flask.request.args.get("since", "today")
+    if since == "today":
+        return datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+    try:
+        return float(since)
+    except ValueError:
+        return None
+
+@safe_runner("/room/density-history/<room_id>")
+def room_density_history(room_id):
+    """Density of the room over time, from the room's density history.
+
+    optional query argument "window", seconds to average over, 300 by default.
+    optional query argument "since", timestamp or "today" (default) for the peak occupancy.
+
+    Args:
+        room_id (str): The ID of the room
+
+    Returns:
+        flask.Response: 200, average_occupancy, average_density, peak_occupancy and the series of
+        (start, average occupancy, peak occupancy) buckets covering the window.
+    """
+    room = ROOMS[room_id]
+    window = flask.request.args.get("window", 300, type=float)
+    since = _history_since()
+    if since is None:
+        return flask.jsonify({"error": "since must be a timestamp or \"today\""}), 400
+    history = room.density_history
+    resolution, series = history.series(window)
+    return flask.jsonify({
+        "window": window,
+        "average_occupancy": history.average_occupancy(window),
+        "average_density": room.average_density(window),
+        "since": since,
+        "peak_occupancy": history.peak_occupancy(since),
+        "resolution": resolution,
+        "series": series,
+    }), 200
+
+@safe_runner("/room/density-history/heatmap/<room_id>")
+def room_density_history_heatmap(room_id):
+    """Heatmap of where people were in the room over the last window seconds.
+
+    optional query argument "window", seconds, 3600 by default.
+    optional query argument "width" and "height" of the image, the size of the room's frames by default.
+
+    Args:
+        room_id (str): The ID of the room
+
+    Returns:
+        flask.Response: the image.
+    """
+    room = ROOMS[room_id]
+    grid = room.density_history.heatmap(flask.request.args.get("window", 3600, type=float))
+    height, width = room.past_frames[-1].shape[:2] if len(room.past_frames) else (480, 640)
+    width = flask.request.args.get("width", width, type=int)
+    height = flask.request.args.get("height", height, type=int)
+    # the grid is already coarse, blur over a few cells only.
+    return image_response(render_density(grid, width, height, scale_factor=1, _kernel_size=3), key=None)
 
 #endregion
 #region Utility
@@ -735,7 +1165,7 @@ def utility_audio():
         logger.error("Audio was not given to /utility/audio")
         return flask.jsonify({"erorr": "audio json key, is required"}), 405
 
-    recog = recognize_from_wav_bytes( base64.b64decode(flask.request.json["audio"]))
+    recog = transcribe_wav(base64.b64decode(flask.request.json["audio"])) or "Could not understand audio"
 
     logger.debug(f"Audio Recognized: {recog}")
 
@@ -752,7 +1182,24 @@ def utility_translate():
         logger.error("text was not given to /utility/translate")
         return flask.jsonify({"erorr": "text json key, is required"}), 405
 
-    return flask.jsonify({"text": translator.translate(flask.request.json["text"], dest='en').text.encode()}), 200
+    return flask.jsonify({"text": translation_service.translate(flask.request.json["text"], dest=flask.request.json.get("dest", "en"))}), 200
+
+@safe_runner("/utility/translate/bulk", methods=["POST"])
+def utility_translate_bulk():
+    """translate many texts, into one or more languages, in one request.
+
+    requires post json "texts", a list of strings, and optional "dest", a language code or a list of them, "en" by default.
+
+    Returns:
+        flask.Response: {"translations": {dest: [translation of each text, in order]}}
+    """
+    texts = flask.request.json.get("texts")
+    if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+        return flask.jsonify({"erorr": "texts json key, a list of strings, is required"}), 405
+    dests = flask.request.json.get("dest", "en")
+    if isinstance(dests, str):
+        dests = [dests]
+    return flask.jsonify({"translations": {dest: translation_service.translate_many(texts, dest=dest) for dest in dests}}), 200
 
 #endregion
 #endregion
@@ -806,7 +1253,7 @@ def gradient():
         flask.Response: image is base64, which is the gradient.
     """
     logger.debug("Gradient Is Being Calculated.")
-    return flask.jsonify({"image" : cv2image_to_base64(create_gradient(get_image_file()))}), 200
+    return image_response(create_gradient(get_image_file()))
 
 #endregion 
 #region Audio Services
@@ -814,13 +1261,39 @@ def gradient():
 @safe_runner("/audio", router=websocket_app.route)
 def audio(ws: WebSocket):
     """A stream of audio is given and the transcribed is given back.
+    every message is a whole wav file, see /audio/stream to send audio as it is recorded.
+    also served by the async websockets (CMS_ASYNC_WS_PORT), which should be prefered.
 
     Args:
         ws (WebSocket): Websocket class.
     """
+    session = AudioSession()
     while True:
-        audio_byte = ws.receive()
-        ws.send(recognize_from_wav_bytes(audio_byte))
+        for reply in session.handle_safely(ws.receive()):
+            ws.send(reply)
+
+@safe_runner("/audio/stream", router=websocket_app.route)
+def audio_stream(ws: WebSocket):
+    """Audio is streamed in as it is recorded, the transcript comes back while it is spoken.
+    also served by the async websockets (CMS_ASYNC_WS_PORT), which should be prefered.
+
+    binary messages are audio, 16 bit little endian mono PCM chunks of any size, 16kHz unless set.
+    text messages are json:
+        {"sample_rate": 8000}: the sample rate of the audio from now on (ends the current utterance).
+        {"end": true}: ends the current utterance now, e.g. when the operator releases the push to talk.
+    json is sent back, {"type": "partial" | "final", "utterance": int, "text": str}, finals also have "start" and "end", in seconds.
+
+    Args:
+        ws (WebSocket): Websocket class.
+    """
+    try:
+        session = AudioStreamSession()
+    except RuntimeError as e:
+        ws.send(json.dumps({"type": "error", "message": str(e)}))
+        return
+    while True:
+        for reply in session.handle_safely(ws.receive()):
+            ws.send(reply)
 
 #endregion
 #region Translation
@@ -828,16 +1301,28 @@ def audio(ws: WebSocket):
 @safe_runner("/translate", router=websocket_app.route)
 def translate_text(ws: WebSocket):
     """it will translate to english.
+    also served by the async websockets (CMS_ASYNC_WS_PORT), which should be prefered.
 
     Args:
         ws (WebSocket): Websocket class.
     """
+    session = TranslateSession()
     while True:
-        text = ws.receive().decode()
-        ws.send(translator.translate(text, dest='en').text.encode())
+        for reply in session.handle_safely(ws.receive()):
+            ws.send(reply)
 
 #endregion
 
+def start_async_websockets():
+    AsyncStreamServer().start()
+
 # if in debug, hot reload.
 if "CMS_ACTIVE" in os.environ:
-    app.run(port=8781, debug=("CMS_DEBUG" in os.environ))
\ No newline at end of file
+    if WORKERS > 1:
+        # load the models once and fork workers which share them, each serves the async websockets too.
+        serve_prefork(app, port=8781, workers=WORKERS, worker_init=start_async_websockets)
+    else:
+        # with the reloader, only in the process which serves, not the one watching the files.
+        if (not "CMS_DEBUG" in os.environ) or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+            start_async_websockets()
+        app.run(port=8781, debug=("CMS_DEBUG" in os.environ))
\ No newline at end of file
@@ -0,0 +1,110 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+
+The CPU thread budget of the process.
+
+rooms, requests and websockets already run inference from many python threads at once,
+if every library also starts a pool the size of the machine for every call the cores are
+oversubscribed many times over, so each library only gets a few threads.
+this module must not import anything heavy, the environment has to be set before numpy and torch are imported.
+"""
+import os
+
+CPU_COUNT = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+
+# intra op threads of torch (florence, yolo on pytorch), per call.
+TORCH_THREADS = int(os.environ.get("CMS_TORCH_THREADS", max(1, CPU_COUNT // 4)))
+TORCH_INTEROP_THREADS = int(os.environ.get("CMS_TORCH_INTEROP_THREADS", 1))
+# intra op threads of the onnxruntime sessions, florence's and the yolo detectors'.
+ONNX_THREADS = int(os.environ.get("CMS_ONNX_THREADS", TORCH_THREADS))
+# threads of opencv (resize, blur, encode), its calls are small and already run from many threads.
+OPENCV_THREADS = int(os.environ.get("CMS_OPENCV_THREADS", 1))
+# threads of the BLAS used by numpy and dlib (face encodings).
+BLAS_THREADS = int(os.environ.get("CMS_BLAS_THREADS", 1))
+# worker processes forked by prefork.py, with more than one the master must not start any thread pool.
+FORK_WORKERS = int(os.environ.get("CMS_WORKERS", 1))
+
+def parse_cores(cores):
+    """"0-3,8" -> {0, 1, 2, 3, 8}, None for an empty string."""
+    if not cores:
+        return None
+    result = set()
+    for part in cores.split(","):
+        start, _, end = part.strip().partition("-")
+        result.update(range(int(start), int(end or start) + 1))
+    return result
+
+# cores the detector workers (and the threads they start) are pinned to, e.g. "0-7", all cores if unset.
+DETECTOR_CORES = parse_cores(os.environ.get("CMS_DETECTOR_CORES"))
+
+def apply_environment():
+    """set the thread counts which libraries read from the environment when they are imported,
+    values already in the environment are left alone."""
+    for name, value in (("OMP_NUM_THREADS", TORCH_THREADS),
+                        ("MKL_NUM_THREADS", BLAS_THREADS),
+                        ("OPENBLAS_NUM_THREADS", BLAS_THREADS),
+                        ("VECLIB_MAXIMUM_THREADS", BLAS_THREADS),
+                        ("NUMEXPR_NUM_THREADS", BLAS_THREADS)):
+        os.environ.setdefault(name, str(value))
+
+def prepare_fork():
+    """make the libraries single threaded before any model is loaded, so the master process of
+    prefork.py has no thread pools at the fork, the pools do not survive it and a worker using one
+    would hang on its first inference. the workers set their budget with configure_libraries."""
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"):
+        os.environ[name] = "1"
+
+    import cv2
+    import torch
+
+    torch.set_num_threads(1)
+    torch.set_num_interop_threads(1)
+    cv2.setNumThreads(0)
+
+def configure_libraries():
+    """set the thread counts of the already imported libraries.
+
+    Returns:
+        dict: the effective configuration.
+    """
+    import cv2
+    import torch
+
+    torch.set_num_threads(TORCH_THREADS)
+    try:
+        torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+    except RuntimeError:
+        # can only be set before torch ran anything in parallel.
+        pass
+    cv2.setNumThreads(OPENCV_THREADS)
+    return thread_report()
+
+def onnx_session_options():
+    """onnxruntime SessionOptions with the thread budget, the default is a thread per core for every session."""
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = ONNX_THREADS
+    options.inter_op_num_threads = 1
+    return options
+
+def pin_current_thread(cores):
+    """pin the calling thread, and the threads it starts from now on, to the given cores."""
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+def thread_report():
+    import cv2
+    import torch
+
+    return {
+        "cpu_count": CPU_COUNT,
+        "torch_threads": torch.get_num_threads(),
+        "torch_interop_threads": torch.get_num_interop_threads(),
+        "onnx_threads": ONNX_THREADS,
+        "opencv_threads": cv2.getNumThreads(),
+        "blas_threads": {name: os.environ.get(name) for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")},
+        "detector_cores": sorted(DETECTOR_CORES) if DETECTOR_CORES else "all",
+    }
@@ -0,0 +1,348 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+
+Streaming speech recognition, without a network connection.
+
+audio comes in as raw 16 bit mono PCM chunks of any size, an energy based voice activity
+detector cuts it into utterances, and only the speech is given to the recognizer, which
+gives partial transcripts while the utterance goes on and a final one when it ends.
+every connection has its own recognizer state, the model itself is loaded once.
+"""
+import io
+import os
+import json
+import time
+import wave
+import threading
+import traceback
+import collections
+import numpy as np
+
+from ..utils import logger, rate_limited_log
+from ..metrics import INFERENCE_LATENCY
+
+# "vosk" (offline, with partial transcripts), "sphinx" (offline, pocketsphinx, finals only)
+# or "google" (the Google web API, needs internet access).
+ASR_BACKEND = os.environ.get("CMS_ASR_BACKEND", "vosk")
+# directory of the vosk model, e.g. vosk-model-small-en-us-0.15 from https://alphacephei.com/vosk/models
+VOSK_MODEL_PATH = os.environ.get("CMS_VOSK_MODEL", "vosk-model-small-en-us-0.15")
+# sample rate of the PCM clients send, unless they say otherwise.
+ASR_SAMPLE_RATE = int(os.environ.get("CMS_ASR_SAMPLE_RATE", 16000))
+
+# voice activity detection.
+VAD_FRAME_MS = 30
+# a frame is speech if its RMS is this many times the noise floor, and at least VAD_MIN_ENERGY.
+VAD_RATIO = float(os.environ.get("CMS_VAD_RATIO", 3.0))
+VAD_MIN_ENERGY = float(os.environ.get("CMS_VAD_MIN_ENERGY", 300))
+# speech this long starts an utterance, silence this long ends it.
+VAD_START_MS = int(os.environ.get("CMS_VAD_START_MS", 90))
+VAD_SILENCE_MS = int(os.environ.get("CMS_VAD_SILENCE_MS", 600))
+# audio before the start of the utterance given to the recognizer too, so the first syllable is not cut off.
+VAD_PREROLL_MS = int(os.environ.get("CMS_VAD_PREROLL_MS", 300))
+# the noise floor is the quietest frame of this long a window, the pauses between words are enough to find it.
+VAD_FLOOR_WINDOW_MS = 3000
+# until this much audio was seen, only VAD_MIN_ENERGY decides.
+VAD_CALIBRATION_MS = 1000
+# utterances are ended after this long, so a final transcript comes even when the speaker never pauses.
+ASR_MAX_UTTERANCE_SECONDS = float(os.environ.get("CMS_ASR_MAX_UTTERANCE_SECONDS", 15))
+
+class EnergyVAD:
+    """Voice activity detection on the energy of fixed size frames.
+
+    the noise floor is the quietest frame of the last few seconds (minimum statistics), so the
+    threshold adapts to the microphone and the room, even when the audio starts with speech.
+    """
+    def __init__(self, sample_rate, ratio=VAD_RATIO, min_energy=VAD_MIN_ENERGY,
+                 start_ms=VAD_START_MS, silence_ms=VAD_SILENCE_MS, preroll_ms=VAD_PREROLL_MS):
+        self.frame_samples = sample_rate * VAD_FRAME_MS // 1000
+        self.frame_bytes = self.frame_samples * 2
+        self.ratio = ratio
+        self.min_energy = min_energy
+        self.start_frames = max(1, start_ms // VAD_FRAME_MS)
+        self.silence_frames = max(1, silence_ms // VAD_FRAME_MS)
+
+        self._energies = collections.deque(maxlen=VAD_FLOOR_WINDOW_MS // VAD_FRAME_MS)
+        self._calibration_frames = VAD_CALIBRATION_MS // VAD_FRAME_MS
+        self.in_speech = False
+        self._preroll = collections.deque(maxlen=max(self.start_frames, preroll_ms // VAD_FRAME_MS))
+        self._voiced = 0
+        self._silent = 0
+
+    def is_speech(self, frame: bytes) -> bool:
+        samples = np.frombuffer(frame, dtype=np.int16).astype(np.float32)
+        energy = float(np.sqrt(np.mean(samples * samples)))
+        self._energies.append(energy)
+        return energy > max(self.min_energy, self.noise_floor * self.ratio)
+
+    @property
+    def noise_floor(self) -> float:
+        if len(self._energies) < self._calibration_frames:
+            return 0.0
+        return min(self._energies)
+
+    def process(self, frame: bytes):
+        """one frame of audio.
+
+        Returns:
+            tuple[bytes, bool]: the audio to give to the recognizer (empty outside of utterances,
+                the preroll when one starts), and whether the utterance ended with this frame.
+        """
+        speech = self.is_speech(frame)
+        if not self.in_speech:
+            self._preroll.append(frame)
+            self._voiced = self._voiced + 1 if speech else 0
+            if self._voiced < self.start_frames:
+                return b"", False
+            self.in_speech = True
+            self._silent = 0
+            audio = b"".join(self._preroll)
+            self._preroll.clear()
+            return audio, False
+
+        self._silent = 0 if speech else self._silent + 1
+        if self._silent >= self.silence_frames:
+            self.end()
+            return frame, True
+        return frame, False
+
+    def end(self):
+        """end the current utterance, the next speech starts a new one."""
+        self.in_speech = False
+        self._voiced = 0
+        self._silent = 0
+
+#region backends
+class _VoskStream:
+    def __init__(self, recognizer):
+        self.recognizer = recognizer
+        self._done = []
+
+    def accept(self, pcm: bytes) -> str:
+        """give audio, returns the partial transcript of the utterance so far."""
+        # vosk has its own endpointing, what it already finished is kept until the utterance ends.
+        if self.recognizer.AcceptWaveform(pcm):
+            self._done.append(json.loads(self.recognizer.Result())["text"])
+            partial = ""
+        else:
+            partial = json.loads(self.recognizer.PartialResult())["partial"]
+        return " ".join(text for text in self._done + [partial] if text)
+
+    def finish(self) -> str:
+        """the final transcript of the utterance, the stream can be used for the next one."""
+        final = json.loads(self.recognizer.FinalResult())["text"]
+        text = " ".join(text for text in self._done + [final] if text)
+        self._done = []
+        return text
+
+class VoskBackend:
+    """vosk (kaldi), fast enough for realtime on a cpu, gives partial transcripts."""
+    name = "vosk"
+
+    def __init__(self, model_path=VOSK_MODEL_PATH):
+        import vosk
+
+        vosk.SetLogLevel(-1)
+        if not os.path.isdir(model_path):
+            raise FileNotFoundError(f"The vosk model {model_path} does not exist, download one from https://alphacephei.com/vosk/models and set CMS_VOSK_MODEL.")
+        self._vosk = vosk
+        self.model = vosk.Model(model_path)
+
+    def stream(self, sample_rate):
+        return _VoskStream(self._vosk.KaldiRecognizer(self.model, sample_rate))
+
+class _BufferedStream:
+    def __init__(self, backend, sample_rate):
+        self.backend = backend
+        self.sample_rate = sample_rate
+        self._audio = bytearray()
+
+    def accept(self, pcm: bytes):
+        # no partial transcripts, the utterance is recognized when it ends.
+        self._audio += pcm
+        return None
+
+    def finish(self) -> str:
+        audio, self._audio = bytes(self._audio), bytearray()
+        return self.backend.recognize(audio, self.sample_rate)
+
+class SpeechRecognitionBackend:
+    """a recognizer of the speech_recognition package, run on whole utterances."""
+    name = None
+
+    def __init__(self):
+        import speech_recognition as sr
+
+        self._sr = sr
+        self._recognizer = sr.Recognizer()
+
+    def recognize(self, pcm: bytes, sample_rate) -> str:
+        audio = self._sr.AudioData(pcm, sample_rate, 2)
+        try:
+            return getattr(self._recognizer, f"recognize_{self.name}")(audio)
+        except self._sr.UnknownValueError:
+            return ""
+        except self._sr.RequestError:
+            rate_limited_log("WARNING", f"The {self.name} speech recognition failed: {traceback.format_exc()}")
+            return ""
+
+    def stream(self, sample_rate):
+        return _BufferedStream(self, sample_rate)
+
+class SphinxBackend(SpeechRecognitionBackend):
+    """pocketsphinx, offline."""
+    name = "sphinx"
+
+    def __init__(self):
+        super().__init__()
+        import pocketsphinx # only to fail here if it is missing, instead of on the first utterance.
+
+class GoogleBackend(SpeechRecognitionBackend):
+    """the Google web speech API, needs internet access."""
+    name = "google"
+
+ASR_BACKENDS = {"vosk": VoskBackend, "sphinx": SphinxBackend, "google": GoogleBackend}
+# tried in this order when the configured backend can not be loaded, never the online one.
+LOCAL_ASR_BACKENDS = ("vosk", "sphinx")
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def load_asr_backend(name=ASR_BACKEND):
+    """Load the backend, or the first local backend which can be loaded if it can not be.
+
+    Raises:
+        RuntimeError: no backend could be loaded.
+    """
+    for candidate in (name,) + tuple(backend for backend in LOCAL_ASR_BACKENDS if backend != name):
+        try:
+            backend = ASR_BACKENDS[candidate]()
+        except Exception:
+            logger.warning(f"Could not load the {candidate} speech recognition: {traceback.format_exc()}")
+            continue
+        logger.info(f"Speech recognition with {candidate}.")
+        return backend
+    raise RuntimeError("No speech recognition backend could be loaded, install vosk (and a model) or pocketsphinx.")
+
+def get_asr_backend():
+    """the backend shared by all connections, loaded on first use."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = load_asr_backend()
+        return _backend
+#endregion
+
+class StreamingRecognizer:
+    """The speech recognition of one audio stream (one connection).
+
+    feed it PCM chunks of any size, it returns the transcripts as they become known:
+        {"type": "partial", "utterance": 0, "text": "turn on the"}
+        {"type": "final", "utterance": 0, "text": "turn on the lights", "start": 1.23, "end": 2.8}
+    start and end are seconds from the start of the stream.
+    """
+    def __init__(self, backend, sample_rate=ASR_SAMPLE_RATE):
+        self.backend = backend
+        self.sample_rate = sample_rate
+        self.vad = EnergyVAD(sample_rate)
+        self._stream = backend.stream(sample_rate)
+        self._remainder = b""
+        self._position = 0 # samples received so far.
+        self._utterance = 0
+        self._start = None
+        self._partial = None
+
+    def _seconds(self, samples):
+        return round(samples / self.sample_rate, 3)
+
+    def _accept(self, audio, events):
+        if not audio:
+            return
+        partial = self._stream.accept(bytes(audio))
+        if partial and partial != self._partial:
+            self._partial = partial
+            events.append({"type": "partial", "utterance": self._utterance, "text": partial})
+
+    def _finish(self, events):
+        st = time.perf_counter()
+        text = self._stream.finish()
+        INFERENCE_LATENCY.observe(time.perf_counter() - st, model=f"asr-{self.backend.name}", prompt="final")
+        if text:
+            events.append({"type": "final", "utterance": self._utterance, "text": text,
+                           "start": self._seconds(self._start), "end": self._seconds(self._position)})
+            self._utterance += 1
+        self._start = None
+        self._partial = None
+
+    def feed(self, pcm: bytes) -> list[dict]:
+        """give the next chunk of audio, 16 bit little endian mono PCM.
+
+        Returns:
+            list[dict]: the transcripts which became known, often none.
+        """
+        events = []
+        data = self._remainder + pcm
+        usable = len(data) - len(data) % self.vad.frame_bytes
+        self._remainder = data[usable:]
+
+        # the speech of the whole chunk is given to the recognizer at once, unless an utterance ends in it.
+        speech = bytearray()
+        for offset in range(0, usable, self.vad.frame_bytes):
+            audio, ended = self.vad.process(data[offset:offset + self.vad.frame_bytes])
+            self._position += self.vad.frame_samples
+            if audio and self._start is None:
+                self._start = max(0, self._position - len(audio) // 2)
+            speech += audio
+            if (not ended) and (self._start is not None) and (self._position - self._start > ASR_MAX_UTTERANCE_SECONDS * self.sample_rate):
+                self.vad.end()
+                ended = True
+            if ended:
+                self._accept(speech, events)
+                speech = bytearray()
+                self._finish(events)
+        self._accept(speech, events)
+        return events
+
+    def flush(self) -> list[dict]:
+        """end the current utterance now, e.g. when the stream ends.
+
+        Returns:
+            list[dict]: its final transcript, if there was one.
+        """
+        events = []
+        if self._start is not None:
+            self.vad.end()
+            self._finish(events)
+        return events
+
+def wav_to_pcm(wav_bytes):
+    """a wav file as 16 bit mono PCM.
+
+    Returns:
+        tuple[bytes, int]: the PCM and its sample rate.
+    """
+    with wave.open(io.BytesIO(wav_bytes)) as wav:
+        sample_rate, channels, width = wav.getframerate(), wav.getnchannels(), wav.getsampwidth()
+        frames = wav.readframes(wav.getnframes())
+    if width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) * 256
+    elif width == 2:
+        samples = np.frombuffer(frames, dtype=np.int16).astype(np.float32)
+    elif width == 4:
+        samples = np.frombuffer(frames, dtype=np.int32).astype(np.float32) / 65536
+    else:
+        raise ValueError(f"Unsupported sample width {width}")
+    return samples.reshape(-1, channels).mean(axis=1).astype(np.int16).tobytes(), sample_rate
+
+def transcribe_wav(wav_bytes, backend=None) -> str:
+    """the transcript of a whole wav file, with the local speech recognition.
+    the clip is given to the recognizer as it is, clips are already trimmed to the speech."""
+    pcm, sample_rate = wav_to_pcm(wav_bytes)
+    backend = backend or get_asr_backend()
+    stream = backend.stream(sample_rate)
+    st = time.perf_counter()
+    stream.accept(pcm)
+    text = stream.finish()
+    INFERENCE_LATENCY.observe(time.perf_counter() - st, model=f"asr-{backend.name}", prompt="wav")
+    return text
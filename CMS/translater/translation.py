@@ -0,0 +1,257 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+
+Cached, batched translation.
+
+alerts and canned announcements are the same few messages over and over, so every translation
+is kept, in memory (LRU) and on disk (TinyDB), keyed by backend, target language and the
+normalized text. what is not cached is sent to the backend in batches, and concurrent requests
+for the same text wait for the one translation already running instead of asking again.
+new translations are written to disk right away, under a file lock, so the prefork workers
+share the file without overwriting each other, and nothing is lost when a worker is killed.
+the disk cache is looked up in an index of the file, which is only read again when the file
+changed, and holds at most CMS_TRANSLATION_DISK_CACHE translations, the oldest are dropped.
+"""
+import os
+import re
+import json
+import fcntl
+import threading
+import unicodedata
+from contextlib import contextmanager
+from collections import OrderedDict
+from tinydb import TinyDB
+
+from ..utils import logger, rate_limited_log
+
+# "google" (googletrans, needs internet access) or "dictionary" (CMS_TRANSLATION_DICTIONARY, offline).
+TRANSLATION_BACKEND = os.environ.get("CMS_TRANSLATION_BACKEND", "google")
+# json file of {language: {text: translation}}, for the dictionary backend.
+TRANSLATION_DICTIONARY = os.environ.get("CMS_TRANSLATION_DICTIONARY", "translations_dictionary.json")
+TRANSLATION_CACHE_PATH = os.environ.get("CMS_TRANSLATION_CACHE", "translations.json")
+TRANSLATION_MEMORY_CACHE = int(os.environ.get("CMS_TRANSLATION_MEMORY_CACHE", 4096))
+TRANSLATION_DISK_CACHE = int(os.environ.get("CMS_TRANSLATION_DISK_CACHE", 100_000))
+# most texts sent to the backend in one call.
+TRANSLATION_BATCH_SIZE = int(os.environ.get("CMS_TRANSLATION_BATCH_SIZE", 32))
+# most characters of one google translate request, longer batches are split.
+GOOGLE_MAX_CHARACTERS = 4500
+
+def normalize(text: str) -> str:
+    """the text translations are cached under, unicode and whitespace differences do not matter."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+class GoogleTranslationBackend:
+    """the google translate web API, through googletrans.
+
+    googletrans sends one request per text even when given a list, so a batch is sent as one
+    text, a line per text (normalized texts have no newlines), and split into lines again.
+    """
+    name = "google"
+
+    def __init__(self):
+        from googletrans import Translator
+
+        self.translator = Translator()
+
+    def _requests(self, texts):
+        request, size = [], 0
+        for text in texts:
+            if request and size + len(text) + 1 > GOOGLE_MAX_CHARACTERS:
+                yield request
+                request, size = [], 0
+            request.append(text)
+            size += len(text) + 1
+        if request:
+            yield request
+
+    def translate_batch(self, texts: list[str], dest: str) -> list[str]:
+        translations = []
+        for request in self._requests(texts):
+            lines = self.translator.translate("\n".join(request), dest=dest).text.split("\n")
+            if len(lines) != len(request):
+                # the lines were merged or split by the translation, one request per text then.
+                rate_limited_log("WARNING", f"A batch of {len(request)} texts came back as {len(lines)} lines, translating them one by one.")
+                lines = [self.translator.translate(text, dest=dest).text for text in request]
+            translations.extend(line.strip() for line in lines)
+        return translations
+
+class DictionaryTranslationBackend:
+    """translations from a json file of {language: {text: translation}}, works offline.
+    texts which are not in it are returned as they are."""
+    name = "dictionary"
+
+    def __init__(self, path=TRANSLATION_DICTIONARY):
+        with open(path, encoding="utf-8") as f:
+            self.dictionary = {dest: {normalize(text): translation for text, translation in entries.items()}
+                               for dest, entries in json.load(f).items()}
+
+    def translate_batch(self, texts: list[str], dest: str) -> list[str]:
+        entries = self.dictionary.get(dest, {})
+        missing = [text for text in texts if not text in entries]
+        if missing:
+            rate_limited_log("WARNING", f"{len(missing)} texts have no {dest} translation in the dictionary, e.g. {missing[0]!r}")
+        return [entries.get(text, text) for text in texts]
+
+TRANSLATION_BACKENDS = {"google": GoogleTranslationBackend, "dictionary": DictionaryTranslationBackend}
+
+class TranslationService:
+    """Translates texts, through the memory and disk caches, and the backend for the rest.
+
+    Args:
+        backend: an object with a name and translate_batch(texts, dest) -> translations.
+        cache_path (str): the TinyDB file of translations, None to only cache in memory.
+    """
+    def __init__(self, backend, cache_path=TRANSLATION_CACHE_PATH, memory_size=TRANSLATION_MEMORY_CACHE,
+                 batch_size=TRANSLATION_BATCH_SIZE, disk_size=TRANSLATION_DISK_CACHE):
+        self.backend = backend
+        self.memory_size = memory_size
+        self.batch_size = batch_size
+        self.disk_size = disk_size
+
+        self._memory = OrderedDict()
+        self._inflight: dict[tuple, threading.Event] = {}
+        self._lock = threading.Lock()
+
+        self.cache_path = cache_path
+        # {(dest, text): (doc id, translation)} of the file, as of _disk_stamp. doc ids only grow,
+        # so the smallest are the oldest translations.
+        self._disk_index = {}
+        self._disk_stamp = None
+        self._disk_lock = threading.Lock()
+
+    @contextmanager
+    def _disk(self, exclusive):
+        """the cache file, locked against the other processes using it (the prefork workers)."""
+        with open(self.cache_path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                with TinyDB(self.cache_path) as db:
+                    yield db.table(self.backend.name)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _remember(self, key, translation):
+        self._memory[key] = translation
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, key):
+        """the translation in memory, None if there is none. must hold the lock."""
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+        return None
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.cache_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load_index(self, table):
+        """read the file into the index if it changed since it was last read. must hold the disk lock."""
+        stamp = self._file_stamp()
+        if stamp != self._disk_stamp:
+            self._disk_index = {(doc["dest"], doc["text"]): (doc.doc_id, doc["translation"]) for doc in table.all()}
+            self._disk_stamp = stamp
+
+    def _read_disk(self, keys):
+        """the translations of the keys which are on disk."""
+        if self.cache_path is None or len(keys) == 0:
+            return {}
+        with self._disk_lock:
+            if self._file_stamp() != self._disk_stamp:
+                with self._disk(exclusive=False) as table:
+                    self._load_index(table)
+            index = self._disk_index
+        return {key: index[key][1] for key in keys if key in index}
+
+    def _write_disk(self, translations):
+        if self.cache_path is None or len(translations) == 0:
+            return
+        with self._disk_lock, self._disk(exclusive=True) as table:
+            self._load_index(table)
+            # another worker may have written some of them since they were looked up.
+            new = [(key, translation) for key, translation in translations.items() if not key in self._disk_index]
+            if new:
+                doc_ids = table.insert_multiple({"dest": dest, "text": text, "translation": translation} for (dest, text), translation in new)
+                for (key, translation), doc_id in zip(new, doc_ids):
+                    self._disk_index[key] = (doc_id, translation)
+
+            excess = len(self._disk_index) - self.disk_size
+            if excess > 0:
+                oldest = sorted(self._disk_index, key=lambda key: self._disk_index[key][0])[:excess]
+                table.remove(doc_ids=[self._disk_index.pop(key)[0] for key in oldest])
+            # the index already has what was just written.
+            self._disk_stamp = self._file_stamp()
+
+    def _translate_missing(self, keys, dest):
+        found = self._read_disk(keys)
+        with self._lock:
+            for key, translation in found.items():
+                self._remember(key, translation)
+
+        keys = [key for key in keys if not key in found]
+        for start in range(0, len(keys), self.batch_size):
+            batch = keys[start:start + self.batch_size]
+            translations = dict(zip(batch, self.backend.translate_batch([text for _, text in batch], dest)))
+            with self._lock:
+                for key, translation in translations.items():
+                    self._remember(key, translation)
+            self._write_disk(translations)
+
+    def translate_many(self, texts: list[str], dest="en") -> list[str]:
+        """Translate the texts into dest, in as few backend calls as possible.
+
+        Args:
+            texts (list[str]): the texts, repeats are only translated once.
+            dest (str): the language code to translate into.
+
+        Returns:
+            list[str]: the translations, in the order of texts.
+        """
+        keys = [(dest, normalize(text)) for text in texts]
+        results, missing, waiting = {}, [], []
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                translation = self._lookup(key)
+                if translation is not None:
+                    results[key] = translation
+                elif key in self._inflight:
+                    waiting.append((key, self._inflight[key]))
+                else:
+                    self._inflight[key] = threading.Event()
+                    missing.append(key)
+
+        try:
+            self._translate_missing(missing, dest)
+        finally:
+            with self._lock:
+                for key in missing:
+                    self._inflight.pop(key).set()
+                    results[key] = self._memory.get(key)
+
+        # translated by another request right now.
+        for key, event in waiting:
+            event.wait()
+            with self._lock:
+                results[key] = self._lookup(key)
+            if results[key] is None:
+                # that request failed, try once more here.
+                self._translate_missing([key], dest)
+                results[key] = self._memory.get(key)
+        return [results[key] for key in keys]
+
+    def translate(self, text: str, dest="en") -> str:
+        return self.translate_many([text], dest)[0]
+
+def load_translation_service(name=TRANSLATION_BACKEND, cache_path=TRANSLATION_CACHE_PATH):
+    logger.info(f"Translating with {name}, cached in {cache_path}.")
+    return TranslationService(TRANSLATION_BACKENDS[name](), cache_path)
+
+if "CMS_ACTIVE" in os.environ:
+    translation_service = load_translation_service()
@@ -3,13 +3,33 @@ Author: Ansh Mathur
 Github: github.com/Fakesum
 Repo: github.com/Thinkodes/CMS
 """
-import requests
-from pydub import AudioSegment
+import os
 import io
+import shutil
+import hashlib
+import threading
+import subprocess
 import urllib.parse
 import base64
+import traceback
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from pydub import AudioSegment
+
+from .utils import logger
+
+# "remote" (the StreamElements voices of lazypy.ro) or "espeak" (espeak-ng installed locally, works offline).
+TTS_BACKEND = os.environ.get("CMS_TTS_BACKEND", "remote")
+TTS_CACHE_DIR = os.environ.get("CMS_TTS_CACHE_DIR", "tts_cache")
+# rendered announcements kept in memory, on top of the ones on disk.
+TTS_MEMORY_CACHE = int(os.environ.get("CMS_TTS_MEMORY_CACHE", 32))
 
-def generate_tts(
+# formats announcements can be served in, and their mimetypes.
+AUDIO_FORMATS = {"mp3": "audio/mpeg", "wav": "audio/wav"}
+
+def request_tts_mp3(
     text: str,
     service: str = "StreamElements",
     voice: str = "Brian",
@@ -17,10 +37,10 @@ def generate_tts(
     g_param: str = "A",
     headers: dict = None,
     api_url: str = "https://lazypy.ro/tts/request_ts.php",
-) -> dict:
+) -> bytes:
     """
-    Convert text to speech and return MP3/WAV bytes.
-    
+    Convert text to speech with the remote service and return the MP3 bytes.
+
     Args:
         text: Input text to convert
         service: TTS service provider (default: StreamElements)
@@ -29,14 +49,6 @@ def generate_tts(
         g_param: Mystery parameter from original request (default: A)
         headers: Custom headers (optional)
         api_url: TTS endpoint URL
-    
-    Returns:
-        Dictionary with 'mp3' and 'wav' keys containing bytes
-    
-    Requires:
-        - requests
-        - pydub
-        - ffmpeg (system installation)
     """
     # Prepare POST data
     data = {
@@ -79,22 +91,199 @@ def generate_tts(
     # Download audio
     mp3_response = requests.get(result["audio_url"])
     mp3_response.raise_for_status()
-    mp3_bytes = mp3_response.content
+    return mp3_response.content
+
+def _export(audio: AudioSegment, fmt: str) -> bytes:
+    buffer = io.BytesIO()
+    audio.export(buffer, format=fmt)
+    return buffer.getvalue()
+
+def generate_tts(text: str, **kwargs) -> dict:
+    """
+    Convert text to speech with the remote service and return MP3/WAV bytes, uncached (see TTSCache).
+
+    Args:
+        text: Input text to convert
+        **kwargs: see request_tts_mp3
+
+    Returns:
+        Dictionary with 'mp3' and 'wav' keys containing base64
+
+    Requires:
+        - requests
+        - pydub
+        - ffmpeg (system installation)
+    """
+    mp3_bytes = request_tts_mp3(text, **kwargs)
 
     # Convert to WAV
     with io.BytesIO(mp3_bytes) as mp3_buffer:
-        audio = AudioSegment.from_file(mp3_buffer, format="mp3")
-        wav_buffer = io.BytesIO()
-        audio.export(wav_buffer, format="wav")
-        wav_bytes = wav_buffer.getvalue()
+        wav_bytes = _export(AudioSegment.from_file(mp3_buffer, format="mp3"), "wav")
 
     return {
         "mp3": base64.b64encode(mp3_bytes).decode(),
         "wav": base64.b64encode(wav_bytes).decode()
     }
 
+def _strip_id3(mp3: bytes) -> bytes:
+    """the mp3 without its leading ID3v2 tag, if it has one."""
+    if mp3[:3] != b"ID3" or len(mp3) < 10:
+        return mp3
+    # the size is 4 syncsafe bytes (7 bits each), without the 10 byte header and the optional footer.
+    size = 10 + ((mp3[6] << 21) | (mp3[7] << 14) | (mp3[8] << 7) | mp3[9]) + (10 if mp3[5] & 0x10 else 0)
+    return mp3[size:]
+
+def repeat_audio(data: bytes, fmt: str, repeat: int) -> bytes:
+    """the audio played repeat times, mp3 frames are concatenated as they are, without encoding again."""
+    if repeat == 1:
+        return data
+    if fmt == "mp3":
+        return data + _strip_id3(data) * (repeat - 1)
+    with io.BytesIO(data) as buffer:
+        return _export(AudioSegment.from_file(buffer, format=fmt) * repeat, fmt)
+
+class RemoteTTS:
+    """the remote StreamElements voices, needs internet access."""
+    name = "remote"
+    # the format render returns.
+    format = "mp3"
+
+    def __init__(self, voice="Brian"):
+        self.voice = voice
+
+    def render(self, text) -> bytes:
+        return request_tts_mp3(text, voice=self.voice)
+
+class EspeakTTS:
+    """espeak-ng (or espeak) on this machine, robotic but offline and fast."""
+    name = "espeak"
+    format = "wav"
+
+    def __init__(self, voice="en"):
+        self.voice = voice
+        self.executable = shutil.which("espeak-ng") or shutil.which("espeak")
+        if self.executable is None:
+            raise RuntimeError("espeak-ng is not installed.")
+
+    def render(self, text) -> bytes:
+        return subprocess.run([self.executable, "--stdout", "-v", self.voice, text], check=True, capture_output=True).stdout
+
+TTS_BACKENDS = {"remote": RemoteTTS, "espeak": EspeakTTS}
+
+def load_tts_backend(name=TTS_BACKEND, voice=None):
+    backend = TTS_BACKENDS[name]
+    return backend() if voice is None else backend(voice)
+
+def _log_prerender_failure(future):
+    error = future.exception()
+    if error is not None:
+        logger.error(f"Could not pre-render an announcement: {''.join(traceback.format_exception(error))}")
+
+class TTSCache:
+    """Rendered announcements, addressed by the hash of backend, voice, text and repetitions.
+
+    kept on disk (and in a small in-memory LRU), so identical announcements are synthesized once,
+    even across restarts. the speech is synthesized once and kept as the backend made it (mp3 for
+    remote, wav for espeak), other formats are converted from it only when they are asked for,
+    so the backend's own format is never encoded a second time. concurrent requests for the same
+    announcement wait for the same render.
+    """
+    def __init__(self, backend, directory=TTS_CACHE_DIR, memory_size=TTS_MEMORY_CACHE, workers=2):
+        self.backend = backend
+        self.directory = directory
+        self.memory_size = memory_size
+        os.makedirs(directory, exist_ok=True)
+
+        self._memory = OrderedDict()
+        self._texts: dict[str, tuple[str, int]] = {}
+        self._key_locks: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts")
+
+    def key(self, text, repeat=1):
+        key = hashlib.sha256(f"{self.backend.name}\0{self.backend.voice}\0{repeat}\0{text}".encode()).hexdigest()
+        with self._lock:
+            self._texts[key] = (text, repeat)
+        return key
+
+    def path(self, key, fmt):
+        return os.path.join(self.directory, f"{key}.{fmt}")
+
+    def _write(self, path, data):
+        # written under a temporary name, so a half written file is never read.
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    def file_by_key(self, key, fmt="mp3"):
+        """Path of the announcement in the given format, rendered now if it is not on disk yet.
+
+        Returns:
+            str: the path, None if the key is not known (neither rendered nor asked for since the start).
+        """
+        if not fmt in AUDIO_FORMATS:
+            raise ValueError(f"Unknown audio format {fmt}")
+        path = self.path(key, fmt)
+        if os.path.exists(path):
+            return path
+
+        with self._lock:
+            if not key in self._texts:
+                return None
+            text, repeat = self._texts[key]
+            lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # one thread renders, the others wait for it and then find the file.
+        with lock:
+            if os.path.exists(path):
+                return path
+            # the announcement as the backend rendered it, the other formats are converted from it.
+            source = self.path(key, self.backend.format)
+            if not os.path.exists(source):
+                logger.info(f"Rendering announcement {key[:12]} with {self.backend.name}: {text!r} x{repeat}")
+                self._write(source, repeat_audio(self.backend.render(text), self.backend.format, repeat))
+            if fmt != self.backend.format:
+                self._write(path, _export(AudioSegment.from_file(source, format=self.backend.format), fmt))
+        return path
+
+    def file(self, text, repeat=1, fmt="mp3"):
+        """Path of the announcement in the given format, rendered now if it is not on disk yet."""
+        return self.file_by_key(self.key(text, repeat), fmt)
+
+    def prerender(self, text, repeat=1, fmt="mp3") -> Future:
+        """Start rendering the announcement in the background.
+
+        Returns:
+            concurrent.futures.Future: resolves to the path of the file.
+        """
+        future = self._executor.submit(self.file, text, repeat, fmt)
+        # nobody waits on a prerender, a failing backend would otherwise only show up as a slow request later.
+        future.add_done_callback(_log_prerender_failure)
+        return future
+
+    def read(self, text, repeat=1, fmt="mp3") -> bytes:
+        key = self.key(text, repeat)
+        with self._lock:
+            if (key, fmt) in self._memory:
+                self._memory.move_to_end((key, fmt))
+                return self._memory[(key, fmt)]
+        with open(self.file_by_key(key, fmt), "rb") as f:
+            data = f.read()
+        with self._lock:
+            self._memory[(key, fmt)] = data
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+        return data
+
+    def get(self, text, repeat=1) -> dict:
+        """the audio of the announcement, {"mp3": bytes, "wav": bytes}, rendered now if it is not cached."""
+        return {fmt: self.read(text, repeat, fmt) for fmt in ("mp3", "wav")}
+
+if "CMS_ACTIVE" in os.environ:
+    tts_cache = TTSCache(load_tts_backend())
+
 # Example usage
 if __name__ == "__main__":
     result = generate_tts("Hello, this is a test!")
     print(f"MP3 size: {len(result['mp3'])} bytes")
-    print(f"WAV size: {len(result['wav'])} bytes")
\ No newline at end of file
+    print(f"WAV size: {len(result['wav'])} bytes")
@@ -3,7 +3,7 @@ Author: Ansh Mathur
 Github: github.com/Fakesum
 Repo: github.com/Thinkodes/CMS
 """
-import os, datetime
+import os, sys, datetime, time
 import cv2
 from loguru import logger
 import speech_recognition as sr
@@ -52,9 +52,53 @@ def generate_log_file(log_dir="logs"):
         f.write("")  # Create an empty file
     return log_file_path
 
-def cv2image_to_base64(image):
-    _, buffer = cv2.imencode('.png', image)
-    return base64.b64encode(buffer.tobytes()).decode()
+# extension and mimetype of the formats images can be encoded to.
+IMAGE_FORMATS = {
+    "png": (".png", "image/png"),
+    "jpeg": (".jpg", "image/jpeg"),
+    "jpg": (".jpg", "image/jpeg"),
+    "webp": (".webp", "image/webp"),
+}
+DEFAULT_IMAGE_FORMAT = os.environ.get("CMS_IMAGE_FORMAT", "png")
+DEFAULT_IMAGE_QUALITY = int(os.environ.get("CMS_IMAGE_QUALITY", 80))
+
+def encode_image(image, fmt=None, quality=None, max_dim=None):
+    """Encode a cv2 image.
+
+    Args:
+        image (numpy.ndarray): the image.
+        fmt (str): one of IMAGE_FORMATS, CMS_IMAGE_FORMAT by default.
+        quality (int): 0-100 quality for jpeg and webp, CMS_IMAGE_QUALITY by default.
+        max_dim (int): downscale the image so neither side is larger than this.
+
+    Returns:
+        tuple[bytes, str]: the encoded image and its mimetype.
+    """
+    fmt = (fmt or DEFAULT_IMAGE_FORMAT).lower()
+    if fmt not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format: {fmt}, must be one of {list(IMAGE_FORMATS)}")
+    extension, mimetype = IMAGE_FORMATS[fmt]
+
+    if max_dim:
+        height, width = image.shape[:2]
+        scale = max_dim / max(height, width)
+        if scale < 1:
+            image = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+
+    quality = DEFAULT_IMAGE_QUALITY if quality is None else int(quality)
+    params = []
+    if extension == ".jpg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif extension == ".webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+
+    ok, buffer = cv2.imencode(extension, image, params)
+    if not ok:
+        raise ValueError(f"Could not encode the image as {fmt}")
+    return buffer.tobytes(), mimetype
+
+def cv2image_to_base64(image, fmt="png", quality=None, max_dim=None):
+    return base64.b64encode(encode_image(image, fmt, quality, max_dim)[0]).decode()
 
 def recognize_from_wav_bytes(wav_bytes):
     # Create a file-like object from bytes
@@ -73,13 +117,48 @@ def recognize_from_wav_bytes(wav_bytes):
             except sr.RequestError:
                 return "API unavailable"
 
+def rate_limited_log(level, message, *args, interval=None, key=None, **kwargs):
+    """Log a message at most once per interval seconds from the same call site,
+    for messages which would otherwise be logged for every frame or request.
+
+    Args:
+        level (str): loguru level name.
+        message (str): the message, formatted with args and kwargs like logger.log.
+        interval (float): seconds between messages, LOG_RATE_LIMIT by default.
+        key (hashable): rate limit by this key instead of the call site.
+    """
+    if key is None:
+        caller = sys._getframe(1)
+        key = (caller.f_code.co_filename, caller.f_lineno)
+    now = time.monotonic()
+    last, suppressed = _rate_limits.get(key, (None, 0))
+    if (last is not None) and (now - last < (LOG_RATE_LIMIT if interval is None else interval)):
+        _rate_limits[key] = (last, suppressed + 1)
+        return
+    _rate_limits[key] = (now, 0)
+    if suppressed:
+        logger.opt(depth=1).log(level, f"{message} ({suppressed} similar messages suppressed)", *args, **kwargs)
+    else:
+        logger.opt(depth=1).log(level, message, *args, **kwargs)
+
+_rate_limits = {}
+
+# the sinks write from a background thread (enqueue), so logging never blocks on disk or the console.
+LOG_LEVEL = os.environ.get("CMS_LOG_LEVEL", "DEBUG")
+CONSOLE_LOG_LEVEL = os.environ.get("CMS_CONSOLE_LOG_LEVEL", LOG_LEVEL)
+LOG_RATE_LIMIT = float(os.environ.get("CMS_LOG_RATE_LIMIT", 5))
+
+logger.remove()
+logger.add(sys.stderr, level=CONSOLE_LOG_LEVEL, enqueue=True)
+
 logger_file = generate_log_file()
-logger.add(logger_file, rotation="10 MB", level="DEBUG")
+# CMS_LOG_JSON writes one json record per line, for log shippers.
+logger.add(logger_file, rotation="10 MB", level=LOG_LEVEL, enqueue=True, serialize="CMS_LOG_JSON" in os.environ)
 
 class DetectionPrompts:
     FIRE = "is there fire."
     STAMPEED = "is there a stampeed happening?"
     FALL = "is there a fall."
-    SMOKE = "is there smoke?",
-    VOILENCE = "is there voilence?",
+    SMOKE = "is there smoke?"
+    VOILENCE = "is there voilence?"
     DANGER = "is there danger?"
\ No newline at end of file
@@ -0,0 +1,7 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+
+Benchmarks for the hot paths of CMS.server, run with `python -m benchmarks`.
+"""
@@ -0,0 +1,86 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+
+Run the benchmarks and write a json report.
+
+    python -m benchmarks --output bench_report.json
+    python -m benchmarks --quick --only graph_solver FaceDatabase
+    python -m benchmarks --compare last_release.json --tolerance 0.2
+"""
+import os
+import sys
+import json
+import argparse
+import datetime
+import platform
+import tempfile
+import importlib
+import traceback
+
+BENCHMARK_MODULES = ["bench_images", "bench_graph", "bench_faces", "bench_alerts", "bench_server"]
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmarks for the CMS server hot paths.")
+    parser.add_argument("--output", default="bench_report.json", help="where to write the json report.")
+    parser.add_argument("--only", nargs="*", default=None, help="only run benchmarks whose name starts with one of these.")
+    parser.add_argument("--quick", action="store_true", help="small problem sizes only, for smoke runs.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.05, help="minimum seconds per repeat.")
+    parser.add_argument("--compare", default=None, help="a previous report, exit with 1 if any benchmark regressed.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown relative to --compare.")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    # CMS writes its log file and alerts.json to the working directory, keep them out of the repo.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.chdir(tempfile.mkdtemp(prefix="cms-benchmarks-"))
+
+    from CMS import __version__
+    from .harness import run, compare
+
+    skipped = []
+    for module in BENCHMARK_MODULES:
+        try:
+            importlib.import_module(f".{module}", __package__)
+        except Exception:
+            print(f"Skipping {module}, it could not be imported:\n{traceback.format_exc()}", file=sys.stderr)
+            skipped.append({"module": module, "error": traceback.format_exc(limit=1)})
+
+    results = run(args.only, quick=args.quick, repeat=args.repeat, min_time=args.min_time)
+
+    report = {
+        "meta": {
+            "cms_version": __version__,
+            "timestamp": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "quick": args.quick,
+        },
+        "skipped": skipped,
+        "results": results,
+    }
+
+    regressions = []
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        report["regressions"] = regressions
+        for regression in regressions:
+            print(f"REGRESSION {regression['name']}: {regression['baseline'] * 1e3:.4f} ms -> {regression['current'] * 1e3:.4f} ms ({regression['change']:+.0%})")
+
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output}")
+
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+"""
+import os
+import tempfile
+from CMS.alerts_database import TinyDBAlertSystem
+from .harness import benchmark
+
+ALERT_COUNTS = (0, 1000, 10000)
+
+def alert_system(prefill=0, unautherized=0):
+    """a TinyDBAlertSystem in its own directory, since it always writes alerts.json to the working directory."""
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        alerts = TinyDBAlertSystem()
+    finally:
+        os.chdir(cwd)
+    alerts.warnings_table.insert_multiple([{"message": f"warning {i}", "timestamp": "", "role": "all"} for i in range(prefill)])
+    for i in range(unautherized):
+        alerts.register_urgent_alert({"message": f"urgent {i}", "room_id": str(i % 10)})
+    alerts.register_warning_alert({"message": "latest warning"})
+    return alerts
+
+@benchmark("TinyDBAlertSystem.register_warning_alert", params=ALERT_COUNTS, quick_params=ALERT_COUNTS[:2])
+def bench_register_warning(prefill):
+    alerts = alert_system(prefill)
+    return lambda: alerts.register_warning_alert({"message": "benchmark warning"})
+
+@benchmark("TinyDBAlertSystem._get_newest_alert", params=ALERT_COUNTS, quick_params=ALERT_COUNTS[:2])
+def bench_get_newest_alert(prefill):
+    alerts = alert_system(prefill)
+    return lambda: alerts._get_newest_alert("warnings")
+
+@benchmark("TinyDBAlertSystem.get_unautherized", params=(10, 100, 1000), quick_params=(10,))
+def bench_get_unautherized(unautherized):
+    alerts = alert_system(unautherized=unautherized)
+    return lambda: alerts.get_unautherized("3")
@@ -0,0 +1,47 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+"""
+import os
+import tempfile
+from tinydb import TinyDB
+from tinydb.storages import MemoryStorage
+from CMS.facial_recognition.database import FaceDatabase
+from .harness import benchmark
+from .fixtures import synthetic_embeddings, synthetic_face_records
+
+FACE_COUNTS = (100, 1000, 10000, 100000)
+
+def face_database(count):
+    """a FaceDatabase filled with `count` synthetic faces, kept in memory."""
+    database = FaceDatabase(os.path.join(tempfile.mkdtemp(), "face_db.json"))
+    database.db = TinyDB(storage=MemoryStorage)
+    database.face_table = database.db.table("faces")
+    database.face_table.insert_multiple(synthetic_face_records(synthetic_embeddings(count)))
+    return database
+
+@benchmark("FaceDatabase.find_match", params=FACE_COUNTS, quick_params=FACE_COUNTS[:2])
+def bench_find_match(count):
+    database = face_database(count)
+    query = synthetic_embeddings(count)[count // 2] + 0.001
+    database.find_match(query)
+    return lambda: database.find_match(query)
+
+@benchmark("FaceDatabase.find_match.cold", params=FACE_COUNTS, quick_params=FACE_COUNTS[:2])
+def bench_find_match_cold(count):
+    """including reading the encodings out of the database, as after a face is added."""
+    database = face_database(count)
+    query = synthetic_embeddings(count)[count // 2] + 0.001
+    def run():
+        database._encodings_cache = None
+        database.find_match(query)
+    return run
+
+@benchmark("FaceDatabase.find_matches.40-faces", params=FACE_COUNTS, quick_params=FACE_COUNTS[:2])
+def bench_find_matches(count):
+    """a crowded frame, 40 faces matched in one query."""
+    database = face_database(count)
+    queries = synthetic_embeddings(40, seed=count)
+    database.find_matches(queries)
+    return lambda: database.find_matches(queries)
@@ -0,0 +1,23 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+"""
+from CMS.graph_solver import rooms_to_nodes, get_optimal_path
+from .harness import benchmark
+from .fixtures import synthetic_building
+
+ROOM_COUNTS = (10, 100, 1000, 10000)
+
+@benchmark("graph_solver.rooms_to_nodes", params=ROOM_COUNTS, quick_params=ROOM_COUNTS[:2])
+def bench_rooms_to_nodes(room_count):
+    rooms = synthetic_building(room_count)
+    return lambda: rooms_to_nodes(rooms)
+
+@benchmark("graph_solver.get_optimal_path", params=ROOM_COUNTS, quick_params=ROOM_COUNTS[:2])
+def bench_get_optimal_path(room_count):
+    """from the room furthest from the first exit, the same way the server calls it."""
+    nodes = rooms_to_nodes(synthetic_building(room_count))
+    start = nodes[str(room_count - 1)]
+    exits = [nodes[room_id] for room_id in nodes if nodes[room_id].is_outer]
+    return lambda: get_optimal_path(start, exits)
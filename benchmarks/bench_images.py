@@ -0,0 +1,39 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+"""
+from CMS import utils, gradient
+from CMS.batching import BatchedDetector
+from .harness import benchmark
+from .fixtures import synthetic_frame, synthetic_image_base64, StubYOLO
+
+FRAME_SIZES = ("640x360", "1280x720", "1920x1080")
+
+def _size(size):
+    width, height = size.split("x")
+    return int(width), int(height)
+
+@benchmark("utils.get_image_file", params=FRAME_SIZES, quick_params=FRAME_SIZES[:1])
+def bench_get_image_file(size):
+    image = synthetic_image_base64(*_size(size))
+    return lambda: utils.get_image_file(image)
+
+@benchmark("utils.cv2image_to_base64", params=FRAME_SIZES, quick_params=FRAME_SIZES[:1])
+def bench_cv2image_to_base64(size):
+    frame = synthetic_frame(*_size(size))
+    return lambda: utils.cv2image_to_base64(frame)
+
+@benchmark("gradient.create_gradient", params=(1, 30, 200), quick_params=(30,))
+def bench_create_gradient(people):
+    """only the post processing, the detector is stubbed to return `people` detections."""
+    gradient.people_detector = BatchedDetector(StubYOLO(people), "yolo11n")
+    frame = synthetic_frame(1280, 720)
+    return lambda: gradient.create_gradient(frame)
+
+@benchmark("batching.BatchedDetector", params=(1, 4, 16), quick_params=(4,))
+def bench_batched_detector(rooms):
+    """one frame of each of `rooms` rooms through the batched detector, the detector is stubbed."""
+    detector = BatchedDetector(StubYOLO(30), "yolo11n")
+    frames = [synthetic_frame(1280, 720, seed=i) for i in range(rooms)]
+    return lambda: detector.predict_many(frames)
@@ -0,0 +1,76 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+"""
+from CMS import server, gradient
+from CMS.batching import BatchedDetector
+from CMS.room import Room
+from .harness import benchmark
+from .fixtures import synthetic_building, synthetic_image_base64, stub_florence_endpoint, StubYOLO
+from .bench_alerts import alert_system
+from .bench_faces import face_database
+
+BUILDING_SIZE = 100
+_client = None
+
+def client():
+    """a flask test client for CMS.server, with stubbed models and a synthetic building."""
+    global _client
+    if _client is not None:
+        return _client
+
+    server.florence_endpoint = stub_florence_endpoint
+    gradient.people_detector = BatchedDetector(StubYOLO(), "yolo11n")
+    server.alerts_database = alert_system(prefill=100)
+    server.face_database = face_database(1000)
+
+    for room_id, fake_room in synthetic_building(BUILDING_SIZE).items():
+        room = Room(room_id, fake_room.room_name, fake_room.room_capacity, fake_room.is_exit)
+        room.connected_roomids = fake_room.connected_roomids
+        server.ROOMS[room_id] = room
+
+    _client = server.app.test_client()
+    return _client
+
+def _get(url):
+    test_client = client()
+    def run():
+        response = test_client.get(url)
+        assert response.status_code < 500, response.data
+    return run
+
+def _post(url, json):
+    test_client = client()
+    def run():
+        response = test_client.post(url, json=json)
+        assert response.status_code < 500, response.data
+    return run
+
+@benchmark("server./room/get-exit-rooms")
+def bench_get_exit_rooms():
+    return _get("/room/get-exit-rooms")
+
+@benchmark("server./room/escape-route")
+def bench_escape_route():
+    return _get(f"/room/escape-route/{BUILDING_SIZE - 1}")
+
+@benchmark("server./room/get-people")
+def bench_get_people():
+    return _get("/room/get-people/0")
+
+@benchmark("server./alerts/warning")
+def bench_alerts_warning():
+    return _get("/alerts/warning")
+
+@benchmark("server./set-warning")
+def bench_set_warning():
+    return _post("/set-warning", {"message": "benchmark warning"})
+
+@benchmark("server./analyze")
+def bench_analyze():
+    return _post("/analyze", {"image": synthetic_image_base64(1280, 720), "prompts": ["is there fire."]})
+
+@benchmark("server./gradient")
+def bench_gradient():
+    return _post("/gradient", {"image": synthetic_image_base64(1280, 720)})
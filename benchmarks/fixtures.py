@@ -0,0 +1,157 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+"""
+import io
+import base64
+import numpy as np
+from PIL import Image
+
+SEED = 1234
+
+def synthetic_frame(width=1280, height=720, seed=SEED):
+    """A noisy BGR frame with some blocks in it, so it does not compress to nothing."""
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 40, size=(height, width, 3), dtype=np.uint8)
+    for _ in range(20):
+        x, y = int(rng.integers(0, width - 50)), int(rng.integers(0, height - 50))
+        w, h = int(rng.integers(20, 200)), int(rng.integers(20, 200))
+        frame[y:y + h, x:x + w] = rng.integers(0, 255, size=3, dtype=np.uint8)
+    return frame
+
+def synthetic_image_base64(width=1280, height=720, fmt="PNG", seed=SEED):
+    """A synthetic frame as it is sent by the clients, base64 encoded image file."""
+    buffer = io.BytesIO()
+    Image.fromarray(synthetic_frame(width, height, seed)[:, :, ::-1]).save(buffer, format=fmt)
+    return base64.b64encode(buffer.getvalue()).decode()
+
+def synthetic_embeddings(count, seed=SEED):
+    """face encodings which look like dlib's, 128 floats of about the same scale."""
+    rng = np.random.default_rng(seed)
+    return rng.normal(0, 0.09, size=(count, 128))
+
+def synthetic_face_records(embeddings):
+    return [{
+        'unique_key': f"face-{i}",
+        "face_encoding": embedding.tolist(),
+        "name": f"person {i}",
+        "desc": "",
+        "rooms_access": [],
+        "admin": False,
+        'image_data': "",
+        'timestamp': "2025-01-01T00:00:00",
+    } for i, embedding in enumerate(embeddings)]
+
+class FakeRoom:
+    """Only the attributes of CMS.room.Room that the graph solver reads, Room itself starts a thread."""
+    def __init__(self, room_name, room_capacity, is_exit):
+        self.room_name = room_name
+        self.room_capacity = room_capacity
+        self.is_exit = is_exit
+        self.connected_roomids = []
+
+def synthetic_building(room_count, seed=SEED):
+    """A building laid out as a grid of rooms, with corridors between neighbours,
+    some random shortcuts and exits on the outer wall.
+
+    Returns:
+        dict[str, FakeRoom]: rooms keyed by room id.
+    """
+    rng = np.random.default_rng(seed)
+    side = max(1, int(np.ceil(np.sqrt(room_count))))
+    rooms = {}
+    for i in range(room_count):
+        row, col = divmod(i, side)
+        on_wall = row == 0 or col == 0 or col == side - 1 or (i + side) >= room_count
+        rooms[str(i)] = FakeRoom(f"room {i}", int(rng.integers(10, 500)), bool(on_wall and rng.random() < 0.1))
+    rooms["0"].is_exit = True
+
+    for i in range(room_count):
+        row, col = divmod(i, side)
+        if col + 1 < side and i + 1 < room_count:
+            rooms[str(i)].connected_roomids.append(str(i + 1))
+        if i + side < room_count:
+            rooms[str(i)].connected_roomids.append(str(i + side))
+        if rng.random() < 0.05:
+            rooms[str(i)].connected_roomids.append(str(int(rng.integers(0, room_count))))
+    return rooms
+
+class StubTensor:
+    """Enough of the torch.Tensor interface for the code reading ultralytics results."""
+    def __init__(self, array):
+        self._array = np.asarray(array)
+
+    def cpu(self):
+        return self
+
+    def detach(self):
+        return self
+
+    def numpy(self):
+        return self._array
+
+    def int(self):
+        return StubTensor(self._array.astype(np.int64))
+
+    def tolist(self):
+        return self._array.tolist()
+
+    def __len__(self):
+        return len(self._array)
+
+    def __iter__(self):
+        return iter(self._array)
+
+class StubBoxes:
+    def __init__(self, xyxy, conf, cls, shape, ids=None):
+        xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        height, width = shape[:2]
+        xywh = np.stack([(xyxy[:, 0] + xyxy[:, 2]) / 2, (xyxy[:, 1] + xyxy[:, 3]) / 2, xyxy[:, 2] - xyxy[:, 0], xyxy[:, 3] - xyxy[:, 1]], axis=1)
+        self.xyxy = StubTensor(xyxy)
+        self.xywh = StubTensor(xywh)
+        self.xywhn = StubTensor(xywh / np.array([width, height, width, height], dtype=np.float32))
+        self.conf = StubTensor(conf)
+        self.cls = StubTensor(cls)
+        self.id = None if ids is None else StubTensor(ids)
+
+    def __len__(self):
+        return len(self.xyxy)
+
+class StubResult:
+    def __init__(self, boxes, orig_shape):
+        self.boxes = boxes
+        self.orig_shape = orig_shape
+
+class StubYOLO:
+    """Stands in for an ultralytics YOLO model, returns a fixed number of people per frame,
+    so benchmarks measure the post processing and not the network."""
+    def __init__(self, people=30, seed=SEED):
+        self.people = people
+        self.seed = seed
+
+    def _result(self, frame, with_ids=False):
+        rng = np.random.default_rng(self.seed)
+        height, width = frame.shape[:2]
+        x1 = rng.uniform(0, width * 0.9, self.people)
+        y1 = rng.uniform(0, height * 0.8, self.people)
+        xyxy = np.stack([x1, y1, np.minimum(x1 + width * 0.05, width - 1), np.minimum(y1 + height * 0.2, height - 1)], axis=1)
+        conf = rng.uniform(0.3, 1.0, self.people)
+        cls = np.zeros(self.people)
+        ids = np.arange(1, self.people + 1) if with_ids else None
+        return StubResult(StubBoxes(xyxy, conf, cls, frame.shape, ids), frame.shape[:2])
+
+    def __call__(self, source, *args, **kwargs):
+        frames = source if isinstance(source, list) else [source]
+        return [self._result(frame) for frame in frames]
+
+    def predict(self, source, *args, **kwargs):
+        return self(source, *args, **kwargs)
+
+    def track(self, source, *args, **kwargs):
+        frames = source if isinstance(source, list) else [source]
+        return [self._result(frame, with_ids=True) for frame in frames]
+
+def stub_florence_endpoint(cv2_image, prompts, *args, **kwargs):
+    """Stands in for CMS.florence.florence_endpoint."""
+    return ["no" for _ in prompts]
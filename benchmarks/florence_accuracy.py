@@ -0,0 +1,119 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+
+Check the int8 quantized florence (CMS_FLORENCE_QUANTIZE) against the float32 model,
+on the DetectionPrompts and the population prompt, and write a json report.
+
+    python -m benchmarks.florence_accuracy
+    python -m benchmarks.florence_accuracy frame1.jpg frame2.jpg --min-agreement 0.9
+    python -m benchmarks.florence_accuracy --onnx
+
+--onnx also checks the onnx runtime (CMS_FLORENCE_BACKEND=onnx), float32 and int8.
+
+without images, frames are sampled from the demo videos in the repository.
+"""
+import io
+import os
+import sys
+import json
+import time
+import glob
+import argparse
+
+import cv2
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def sample_video_frames(per_video=3):
+    frames = []
+    for path in sorted(glob.glob(os.path.join(ROOT, "*.mp4"))):
+        capture = cv2.VideoCapture(path)
+        count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        for i in range(per_video):
+            capture.set(cv2.CAP_PROP_POS_FRAMES, (i + 1) * count // (per_video + 1))
+            ok, frame = capture.read()
+            if ok:
+                frames.append((f"{os.path.basename(path)}#{i}", frame))
+        capture.release()
+    return frames
+
+def model_size(model):
+    """bytes of the serialized weights."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+def _normalize(answer):
+    return str(answer).strip().lower().rstrip(".")
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.florence_accuracy", description=__doc__.split("\n\n")[1])
+    parser.add_argument("images", nargs="*", help="images to ask about, frames of the demo videos by default.")
+    parser.add_argument("--per-video", type=int, default=3, help="frames sampled from every demo video.")
+    parser.add_argument("--output", default="florence_accuracy.json")
+    parser.add_argument("--onnx", action="store_true", help="also check the onnx runtime.")
+    parser.add_argument("--min-agreement", type=float, default=None, help="exit with 1 if the answers agree less often than this.")
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from CMS import florence
+    from CMS.florence_runtime import load_florence_runtime, FlorenceRuntime
+    from CMS.utils import DetectionPrompts
+
+    prompts = [value for name, value in vars(DetectionPrompts).items() if not name.startswith("_")] + ["how many people?"]
+    frames = [(path, cv2.imread(path)) for path in args.images] if args.images else sample_video_frames(args.per_video)
+
+    florence.florence_processor = florence.load_florence_processor()
+    models = {"float32": florence.load_florence(quantize=False), "int8": florence.load_florence(quantize=True)}
+    if args.onnx:
+        for name, quantize in (("onnx-float32", False), ("onnx-int8", True)):
+            runtime = load_florence_runtime(lambda: models["float32"], florence.florence_processor, florence.FLORENCE_ONNX_PATH, quantize)
+            if isinstance(runtime, FlorenceRuntime):
+                models[name] = runtime
+
+    answers = {name: {} for name in models}
+    latency = {name: 0.0 for name in models}
+    for name, model in models.items():
+        for image_name, frame in frames:
+            st = time.perf_counter()
+            answers[name][image_name] = florence.florence_endpoint(frame, prompts, model=model)
+            latency[name] += time.perf_counter() - st
+
+    # every model is compared against the float32 pytorch model.
+    per_prompt = {}
+    for name in models:
+        if name == "float32":
+            continue
+        per_prompt[name] = {}
+        for i, prompt in enumerate(prompts):
+            agreed = sum(_normalize(answers["float32"][image][i]) == _normalize(answers[name][image][i]) for image, _ in frames)
+            per_prompt[name][prompt] = agreed / len(frames)
+    agreement = {name: sum(values.values()) / len(values) for name, values in per_prompt.items()}
+
+    report = {
+        "images": len(frames),
+        "agreement": agreement,
+        "agreement_per_prompt": per_prompt,
+        "seconds_per_image": {name: total / len(frames) for name, total in latency.items()},
+        "model_bytes": {name: model_size(model) for name, model in models.items() if not isinstance(model, FlorenceRuntime)},
+        "answers": answers,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+
+    for name, value in agreement.items():
+        print(f"{name} agreement with float32: {value:.1%} over {len(frames)} images")
+        for prompt, prompt_agreement in per_prompt[name].items():
+            print(f"    {prompt!r}: {prompt_agreement:.1%}")
+    for name in models:
+        size = report["model_bytes"].get(name)
+        print(f"{name}: {report['seconds_per_image'][name]:.2f} s/image" + (f", {size / 2**20:.0f} MiB" if size else ""))
+
+    if args.min_agreement is not None and min(agreement.values()) < args.min_agreement:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Author: Ansh Mathur
+Github: github.com/Fakesum
+Repo: github.com/Thinkodes/CMS
+"""
+import time
+import statistics
+
+BENCHMARKS = []
+
+class Benchmark:
+    def __init__(self, name, setup, params, quick_params):
+        self.name = name
+        self.setup = setup
+        self.params = params
+        self.quick_params = quick_params
+
+def benchmark(name, params=(None,), quick_params=None):
+    """Register a benchmark.
+
+    the decorated function is called once per param with the param (or without
+    arguments if params is the default), it does all the setup and returns the
+    zero argument callable which is timed.
+
+    Args:
+        name (str): name of the benchmark, reported as name[param].
+        params (tuple): the parameters to run the benchmark with, e.g. problem sizes.
+        quick_params (tuple): the parameters used with --quick, defaults to params.
+    """
+    def decorator(setup):
+        BENCHMARKS.append(Benchmark(name, setup, params, params if quick_params is None else quick_params))
+        return setup
+    return decorator
+
+def measure(fn, repeat=5, min_time=0.05, max_number=100000):
+    """Time fn, calibrating the number of calls per repeat so one repeat takes at least min_time.
+
+    Returns:
+        dict: per call timings in seconds.
+    """
+    number = 1
+    while True:
+        st = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - st
+        if elapsed >= min_time or number >= max_number:
+            break
+        number = min(max_number, number * 10 if elapsed == 0 else max(number * 2, int(number * min_time / elapsed) + 1))
+
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        st = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - st) / number)
+
+    timings.sort()
+    return {
+        "repeat": repeat,
+        "number": number,
+        "min": timings[0],
+        "median": statistics.median(timings),
+        "mean": statistics.fmean(timings),
+        "stdev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "p95": timings[min(len(timings) - 1, int(round(0.95 * (len(timings) - 1))))],
+        "ops_per_sec": (1 / statistics.median(timings)) if statistics.median(timings) > 0 else float("inf"),
+    }
+
+def result_name(name, param):
+    return name if param is None else f"{name}[{param}]"
+
+def run(selected=None, quick=False, repeat=5, min_time=0.05, log=print):
+    """Run the registered benchmarks.
+
+    Args:
+        selected (list[str]): only run the benchmarks whose name starts with one of these.
+        quick (bool): use the quick params, for smoke runs.
+
+    Returns:
+        list[dict]: one result per benchmark and param.
+    """
+    results = []
+    for bench in BENCHMARKS:
+        if selected and not any(bench.name.startswith(prefix) for prefix in selected):
+            continue
+        for param in (bench.quick_params if quick else bench.params):
+            name = result_name(bench.name, param)
+            fn = bench.setup() if param is None else bench.setup(param)
+            stats = measure(fn, repeat=repeat, min_time=min_time)
+            results.append({"name": name, "benchmark": bench.name, "param": param, **stats})
+            log(f"{name:<60} median {stats['median'] * 1e3:12.4f} ms   {stats['ops_per_sec']:14.1f} ops/s")
+    return results
+
+def compare(results, baseline, tolerance):
+    """Compare results with a baseline report.
+
+    Returns:
+        list[dict]: the benchmarks whose median is slower than the baseline by more than tolerance.
+    """
+    baseline = {result["name"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        if result["name"] not in baseline:
+            continue
+        before = baseline[result["name"]]["median"]
+        if before > 0 and (result["median"] - before) / before > tolerance:
+            regressions.append({"name": result["name"], "baseline": before, "current": result["median"], "change": (result["median"] - before) / before})
+    return regressions